@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import textstat
+from sklearn.feature_extraction.text import TfidfVectorizer
+from textblob import TextBlob
+
+CTA_KEYWORDS = ["start", "buy", "get", "join", "try", "explore", "discover", "learn", "download"]
+URGENCY_KEYWORDS = ["now", "limited", "today", "hurry", "exclusive", "instant", "fast"]
+TRUST_KEYWORDS = ["trusted", "guaranteed", "proven", "safe", "secure", "backed", "certified"]
+
+# Below this many ads the process pool costs more than it saves
+PARALLEL_THRESHOLD = 200
+
+
+def compile_signal_matcher(groups):
+    """
+    Compiles keyword groups into one case-insensitive regex scanned in a single pass.
+
+    Every keyword is matched as a substring (like `kw in text.lower()`); the
+    zero-width lookahead lets matches overlap, so a keyword is never hidden by
+    one that starts earlier.
+    """
+    alternatives = "|".join(
+        f"(?P<{name}>{'|'.join(re.escape(kw) for kw in sorted(keywords, key=len, reverse=True))})"
+        for name, keywords in groups.items()
+    )
+    return re.compile(f"(?=(?:{alternatives}))", re.IGNORECASE)
+
+
+SIGNAL_MATCHER = compile_signal_matcher({"cta": CTA_KEYWORDS, "urgency": URGENCY_KEYWORDS, "trust": TRUST_KEYWORDS})
+
+
+def detect_signals(text):
+    """Names of the keyword groups (cta, urgency, trust) present in `text`."""
+    return {match.lastgroup for match in SIGNAL_MATCHER.finditer(text)}
+
+
+def _text_metrics(text):
+    """Per-text scores that need a full pass over the text (run in worker processes)."""
+    words = text.split()
+    sentences = [s.strip() for s in text.split('.') if s.strip()]
+    return (
+        textstat.flesch_reading_ease(text),
+        TextBlob(text).sentiment.polarity,
+        len(words),
+        sum(len(s.split()) for s in sentences) / len(sentences) if sentences else 0,
+        len(set(words)) / len(words) if words else 0,
+    )
+
+
+def tfidf_matrix(texts):
+    """One shared TF-IDF fit over all texts; rows are L2-normalised."""
+    return TfidfVectorizer().fit_transform(texts)
+
+
+def pairwise_similarity(texts):
+    """Sparse all-pairs cosine similarity from a single TF-IDF fit."""
+    matrix = tfidf_matrix(texts)
+    return (matrix @ matrix.T).tocsr()
+
+
+def evaluate_ads(texts, index=None, processes=None):
+    """
+    Scores many ads at once and returns one DataFrame row per ad.
+
+    Readability and sentiment run on a process pool for large inputs, keyword
+    signals use one precompiled matcher, and "Max Similarity" is each ad's
+    highest cosine similarity to any other ad from a single shared TF-IDF fit.
+    """
+    texts = list(texts)
+    if not texts:
+        return pd.DataFrame()
+
+    if len(texts) >= PARALLEL_THRESHOLD and processes != 1:
+        workers = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            metrics = list(pool.map(_text_metrics, texts, chunksize=max(1, len(texts) // (workers * 4))))
+    else:
+        metrics = [_text_metrics(text) for text in texts]
+
+    signals = [detect_signals(text) for text in texts]
+    df = pd.DataFrame(
+        metrics,
+        columns=["Readability Score", "Sentiment Score", "Word Count", "Avg Sentence Length", "Unique Word Ratio"],
+        index=index,
+    )
+    df["Has CTA"] = ["cta" in s for s in signals]
+    df["Has Urgency"] = ["urgency" in s for s in signals]
+    df["Has Trust Signals"] = ["trust" in s for s in signals]
+
+    if len(texts) > 1:
+        similarity = pairwise_similarity(texts).tolil()
+        similarity.setdiag(0)
+        df["Max Similarity"] = np.asarray(similarity.tocsr().max(axis=1).todense()).ravel()
+    else:
+        df["Max Similarity"] = 0.0
+    return df
+
+
+def compare_ads(ad_a, ad_b, labels=("Your Ad", "Competitor Ad")):
+    """Side-by-side metric table for two ads, with their semantic similarity as the last row."""
+    scores = evaluate_ads([ad_a, ad_b], index=list(labels)).drop(columns=["Max Similarity"])
+    similarity = pairwise_similarity([ad_a, ad_b])[0, 1]
+    comparison_df = scores.T.reset_index().rename(columns={"index": "Metric"})
+    comparison_df.columns.name = None
+    comparison_df.loc[len(comparison_df.index)] = ["Semantic Similarity", similarity, similarity]
+    return comparison_df
+
+
+def load_ads(path):
+    """Reads `ad_text` records from a JSONL file such as the batch generation output."""
+    products, texts = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("ad_text"):
+                products.append(record.get("product"))
+                texts.append(record["ad_text"])
+    return products, texts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score every ad in a JSONL file (e.g. batch output).")
+    parser.add_argument("ads", help="JSONL file with `product` and `ad_text` fields")
+    parser.add_argument("--output", help="Write scores to this CSV instead of printing them")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes for text scoring")
+    args = parser.parse_args()
+
+    products, texts = load_ads(args.ads)
+    scores = evaluate_ads(texts, index=pd.Index(products, name="product"), processes=args.processes)
+    if args.output:
+        scores.to_csv(args.output)
+        print(f"✅ Scored {len(scores)} ads -> {args.output}")
+    else:
+        print(scores)
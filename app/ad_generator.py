@@ -1,33 +1,401 @@
-import google.generativeai as genai
-from config import GEMINI_API_KEY
-from pinecone_db import query_pinecone, store_ad_in_pinecone, query_ad_pinecone
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
 
-# Configure Gemini API
-genai.configure(api_key=GEMINI_API_KEY)
+from config import (
+    GEMINI_API_KEY,
+    GENERATION_REQUESTS_PER_MINUTE,
+    GENERATION_CACHE_ENABLED,
+    GENERATION_CACHE_PATH,
+    GENERATION_CACHE_TTL,
+    GENERATION_CACHE_MAX_ENTRIES,
+    GENERATION_CACHE_SIMILARITY,
+    GENERATION_DEADLINE,
+    GENERATION_HEDGE_AFTER,
+)
+from embedding import get_embedding
+from pinecone_db import ad_key, query_pinecone, store_ad_in_pinecone, query_ad_pinecone, fetch_ad
+from rate_limit import TokenBucket
+from resilience import CircuitOpenError, ModelPreference, call, get_breaker
+import metrics
 
-def generate_ad(product, force_regenerate=False):
+PRIMARY_MODEL = "gemini-1.5-flash"
+FALLBACK_MODEL = "text-bison@001"
+
+_genai = None
+_models = {}
+_rate_limiters = {}
+_models_lock = threading.Lock()
+_model_preference = None
+
+def _configured_genai():
+    """Imports and configures the Gemini SDK on first use (it is slow to import)."""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        # Configure Gemini API
+        genai.configure(api_key=GEMINI_API_KEY)
+        _genai = genai
+    return _genai
+
+def get_model(name):
+    """Returns a shared GenerativeModel client for `name`, created on first use."""
+    with _models_lock:
+        if name not in _models:
+            _models[name] = _configured_genai().GenerativeModel(name)
+            _rate_limiters[name] = TokenBucket.per_minute(GENERATION_REQUESTS_PER_MINUTE.get(name, 15))
+        return _models[name]
+
+def register_model(name, model):
+    """Uses `model` (any object with Gemini's `generate_content`) for `name`, e.g. a fake in benchmarks."""
+    with _models_lock:
+        _models[name] = model
+        _rate_limiters[name] = TokenBucket.per_minute(GENERATION_REQUESTS_PER_MINUTE.get(name, 15))
+
+def _endpoint(name):
+    """Circuit breaker name for a generation model."""
+    return f"generate:{name}"
+
+def _get_model_preference():
+    global _model_preference
+    with _models_lock:
+        if _model_preference is None:
+            _model_preference = ModelPreference(GEMINI_API_KEY)
+        return _model_preference
+
+def candidate_models():
     """
-    Generates an ad for a product using Gemini 1.5 Flash based on retrieved reviews.
-    Implements Retrieval-Augmented Generation (RAG) with Pinecone.
-    Make sure the Ad has the appropriate trust signals, urgency and call to action 
-    Parameters:
-      product (str): The product name.
-      force_regenerate (bool): If True, regenerates the ad even if one exists.
-    
-    Returns:
-      str: The generated advertisement.
+    Generation models in the order to try them.
+
+    Models this API key could not use (unknown model, no access) are demoted
+    for MODEL_DEMOTION_TTL, and models whose circuit is open come last, so a
+    failing model is not retried on every call.
     """
-    # Check if an ad already exists in Pinecone unless we're forcing a regeneration.
-    if not force_regenerate:
-        existing_ads = query_ad_pinecone(product)
-        if existing_ads:
-            # Verify if the retrieved ad appears to match the product
-            if any(product.lower() in ad.lower() for ad in existing_ads):
-                print(f"✅ Retrieved existing ad for {product} from Pinecone.")
-                return existing_ads[0]
-            else:
-                print("ℹ️ Existing ad found but does not seem to match the product; regenerating.")
+    return _get_model_preference().order((PRIMARY_MODEL, FALLBACK_MODEL), endpoint=_endpoint)
 
+def generate_with_model(name, prompt):
+    """
+    Calls `name` under its per-model rate limit and circuit breaker; returns the response text (or None).
+
+    Transient errors are retried with jitter within GENERATION_DEADLINE, and each
+    request times out at what is left of it; with GENERATION_HEDGE_AFTER set, a
+    slow request is hedged with a second one.
+    """
+    model = get_model(name)
+    expires = time.monotonic() + GENERATION_DEADLINE
+
+    def attempt():
+        _rate_limiters[name].acquire()
+        metrics.incr("api_calls", service=name)
+        timeout = max(1.0, expires - time.monotonic())
+        with metrics.span("generate", model=name):
+            response = model.generate_content(prompt, request_options={"timeout": timeout})
+            return response, response.text if hasattr(response, "text") else None
+
+    try:
+        response, text = call(
+            _endpoint(name),
+            attempt,
+            retries=1,
+            deadline=GENERATION_DEADLINE,
+            hedge_after=GENERATION_HEDGE_AFTER or None,
+        )
+    except Exception as e:
+        _get_model_preference().record_failure(name, e)
+        raise
+    _count_tokens(name, response, text)
+    if text:
+        _get_model_preference().record_success(name)
+    return text
+
+def _count_tokens(name, response, text):
+    """Records generated tokens from the response's usage metadata (characters when it has none)."""
+    if not metrics.enabled():
+        return
+    usage = getattr(response, "usage_metadata", None)
+    tokens = getattr(usage, "candidates_token_count", None) if usage is not None else None
+    if tokens:
+        metrics.incr("tokens_generated", tokens, model=name)
+    elif text:
+        metrics.incr("chars_generated", len(text), model=name)
+
+def stream_with_model(name, prompt):
+    """
+    Streams response text chunks from `name` under its per-model rate limit.
+
+    Shares the model's circuit breaker with `generate_with_model`; streams are
+    not retried because text may already have reached the caller.
+    """
+    breaker = get_breaker(_endpoint(name))
+    if not breaker.allow():
+        raise CircuitOpenError(f"{_endpoint(name)} is unavailable (circuit open)")
+    model = get_model(name)
+    _rate_limiters[name].acquire()
+    metrics.incr("api_calls", service=name)
+    try:
+        with metrics.span("generate", model=name, mode="stream"):
+            started = time.perf_counter()
+            last_chunk = None
+            chunks = model.generate_content(prompt, stream=True, request_options={"timeout": GENERATION_DEADLINE})
+            for chunk in chunks:
+                last_chunk = chunk
+                text = getattr(chunk, "text", None)
+                if text:
+                    if started is not None:
+                        metrics.observe("time_to_first_chunk_seconds", time.perf_counter() - started, model=name)
+                        started = None
+                    yield text
+    except GeneratorExit:
+        breaker.record_success()  # The caller stopped reading; the model itself was answering
+        raise
+    except Exception as e:
+        breaker.record_failure()
+        _get_model_preference().record_failure(name, e)
+        raise
+    breaker.record_success()
+    if started is None:
+        _get_model_preference().record_success(name)
+    # The final chunk carries the usage totals for the whole response
+    _count_tokens(name, last_chunk, None)
+
+class GenerationCache:
+    """
+    Disk-backed cache of LLM generations.
+
+    Exact hits are keyed on (model, hash of the normalised prompt). Each entry
+    can also carry a unit-length embedding of the retrieved reviews, so a new
+    prompt for the same product whose review context is at least `similarity`
+    cosine-similar reuses the earlier ad. Entries expire after their own TTL
+    and the least recently used rows are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, path=GENERATION_CACHE_PATH, ttl=GENERATION_CACHE_TTL,
+                 max_entries=GENERATION_CACHE_MAX_ENTRIES, similarity=GENERATION_CACHE_SIMILARITY):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " product TEXT NOT NULL,"
+            " context BLOB,"
+            " ad_text TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS generations_product ON generations (model, product)")
+        self._conn.commit()
+
+    @staticmethod
+    def prompt_key(model, prompt):
+        normalized = " ".join(prompt.split()).casefold()
+        return hashlib.sha256(f"{model}\0{normalized}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(vector):
+        values = array("f", (float(v) for v in vector))
+        norm = math.sqrt(sum(v * v for v in values))
+        if not norm:
+            return None
+        return array("f", (v / norm for v in values))
+
+    def get(self, model, prompt):
+        """The cached ad for exactly this prompt, or None."""
+        key = self.prompt_key(model, prompt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ad_text FROM generations WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row:
+                self._conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+        return row[0] if row else None
+
+    def get_similar(self, model, product, context):
+        """
+        The cached ad for `product` whose review context is most similar to `context`.
+
+        Returns (ad_text, similarity) for the best entry at or above the threshold, else None.
+        """
+        if not self.similarity or context is None:
+            return None
+        query = self._normalize(context)
+        if query is None:
+            return None
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, context, ad_text FROM generations"
+                " WHERE model = ? AND product = ? AND context IS NOT NULL AND expires_at > ?",
+                (model, ad_key(product), now),
+            ).fetchall()
+        best = None
+        for key, blob, ad_text in rows:
+            stored = array("f")
+            stored.frombytes(blob)
+            if len(stored) != len(query):
+                continue  # Embedded with a different model
+            score = sum(a * b for a, b in zip(query, stored))
+            if score >= self.similarity and (best is None or score > best[0]):
+                best = (score, key, ad_text)
+        if best is None:
+            return None
+        with self._lock:
+            self._conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (now, best[1]))
+            self._conn.commit()
+        return best[2], best[0]
+
+    def put(self, model, prompt, product, ad_text, context=None, ttl=None):
+        """Stores a generation; `ttl` overrides the cache-wide TTL for this entry."""
+        vector = self._normalize(context) if context is not None else None
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key, model, product, context, ad_text, expires_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.prompt_key(model, prompt), model, ad_key(product),
+                 vector.tobytes() if vector is not None else None, ad_text, now + (ttl or self.ttl), now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM generations WHERE expires_at <= ?", (now,))
+        if not self.max_entries:
+            return
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM generations WHERE key IN"
+                " (SELECT key FROM generations ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM generations")
+            self._conn.commit()
+
+_generation_cache = None
+
+def get_generation_cache():
+    """Returns the shared generation cache, or None when it is disabled."""
+    global _generation_cache
+    if not GENERATION_CACHE_ENABLED:
+        return None
+    with _models_lock:
+        if _generation_cache is None:
+            _generation_cache = GenerationCache()
+        return _generation_cache
+
+def _context_embedding(reviews):
+    """Embedding of the retrieved review set, used for near-duplicate cache hits."""
+    cache = get_generation_cache()
+    if not reviews or cache is None or not cache.similarity:
+        return None
+    try:
+        return get_embedding("\n".join(reviews))
+    except Exception as e:
+        print(f"⚠️ Could not embed the review context for the generation cache: {e}")
+        return None
+
+def lookup_generation(product, prompt, reviews):
+    """
+    Checks the generation cache before calling a model.
+
+    Returns (ad_text, context): the cached ad or None, and the review-context
+    embedding computed for the near-duplicate check so `remember_generation`
+    can reuse it.
+    """
+    cache = get_generation_cache()
+    if cache is None:
+        return None, None
+    for name in (PRIMARY_MODEL, FALLBACK_MODEL):
+        ad_text = cache.get(name, prompt)
+        if ad_text:
+            print(f"♻️ Reusing a cached {name} generation for this prompt.")
+            metrics.incr("cache_hits", cache="generation", match="exact")
+            return ad_text, None
+    context = _context_embedding(reviews)
+    if context is not None:
+        for name in (PRIMARY_MODEL, FALLBACK_MODEL):
+            hit = cache.get_similar(name, product, context)
+            if hit:
+                print(f"♻️ Reusing a cached {name} generation (review context {hit[1]:.3f} similar).")
+                metrics.incr("cache_hits", cache="generation", match="similar")
+                return hit[0], context
+    metrics.incr("cache_misses", cache="generation")
+    return None, context
+
+def remember_generation(model_name, product, prompt, ad_text, context=None):
+    cache = get_generation_cache()
+    if cache is None:
+        return
+    try:
+        cache.put(model_name, prompt, product, ad_text, context)
+    except sqlite3.Error as e:
+        print(f"⚠️ Warning: failed to cache the generated ad: {e}")
+
+def local_generate_ad(product_name, reviews_list):
+    """Local fallback: simple template-based RAG-style generation using retrieved reviews."""
+    # Basic heuristics: pick up to 3 strongest review snippets and build a short ad
+    snippets = []
+    if isinstance(reviews_list, str):
+        text = reviews_list
+        # split into sentences and take the first few non-empty ones
+        parts = [s.strip() for s in text.replace('\n', ' ').split('.') if s.strip()]
+        snippets = parts[:3]
+    elif isinstance(reviews_list, list):
+        # take first sentence from each review up to 3
+        for r in reviews_list:
+            if not r:
+                continue
+            s = r.replace('\n', ' ').strip()
+            # use up to first 200 chars
+            snippets.append(s[:200])
+            if len(snippets) >= 3:
+                break
+
+    # Compose ad
+    headline = f"Try {product_name} — Loved by customers"
+    body = " ".join(snippets) if snippets else f"Discover why customers love {product_name}."
+    cta = "Buy now and enjoy the difference!"
+    ad = f"{headline}\n\n{body}\n\n{cta}"
+    return ad
+
+def find_existing_ad(product):
+    """Returns a stored ad for the product, or None if it has to be generated."""
+    # Fast path: exact lookup by normalised product key, no embedding or vector search
+    existing_ad = fetch_ad(product)
+    if existing_ad:
+        print(f"✅ Retrieved existing ad for {product} from Pinecone.")
+        return existing_ad
+
+    # Fuzzy fallback: semantic search for ads stored under a differently written product name
+    existing_ads = query_ad_pinecone(product)
+    if existing_ads:
+        # Verify if the retrieved ad appears to match the product
+        if any(product.lower() in ad.lower() for ad in existing_ads):
+            print(f"✅ Retrieved existing ad for {product} from Pinecone.")
+            return existing_ads[0]
+        else:
+            print("ℹ️ Existing ad found but does not seem to match the product; regenerating.")
+    return None
+
+def build_prompt(product):
+    """Retrieves reviews for the product and builds the RAG prompt; returns (prompt, reviews)."""
     # Retrieve relevant reviews from the Pinecone vector database
     reviews = query_pinecone(product, top_k=5)
 
@@ -47,67 +415,165 @@ Base your ad on the following customer reviews and insights:
 
 Ensure the ad is engaging, persuasive, and accurately highlights the best aspects of the product.
     """
+    return prompt, reviews
 
+def _try_store_ad(product, fallback_ad):
     try:
-        # Preferred model: try Gemini; some projects or API plans may not support every model name.
-        try:
-            model = genai.GenerativeModel("gemini-1.5-flash")
-            response = model.generate_content(prompt)
-            ad_text = response.text if hasattr(response, "text") else None
-        except Exception:
-            # If the preferred model isn't available for this API version/plan, try a more compatible approach
+        store_ad_in_pinecone(product, fallback_ad)
+    except Exception as store_exc:
+        print(f"⚠️ Warning: failed to store ad in Pinecone: {store_exc}")
+
+def generate_ad(product, force_regenerate=False):
+    """
+    Generates an ad for a product using Gemini 1.5 Flash based on retrieved reviews.
+    Implements Retrieval-Augmented Generation (RAG) with Pinecone.
+    Make sure the Ad has the appropriate trust signals, urgency and call to action 
+    Parameters:
+      product (str): The product name.
+      force_regenerate (bool): If True, regenerates the ad even if one exists.
+    
+    Returns:
+      str: The generated advertisement.
+    """
+    return generate_ad_with_source(product, force_regenerate)[0]
+
+def generate_ad_with_source(product, force_regenerate=False):
+    """
+    `generate_ad`, also telling where the ad came from.
+
+    Returns (ad_text, source): source is the model name for a fresh generation,
+    "stored" for an ad already in Pinecone, "cache" for a generation-cache hit and
+    "template" when every model failed and the local template was used.
+    """
+    # Check if an ad already exists in Pinecone unless we're forcing a regeneration.
+    if not force_regenerate:
+        existing_ad = find_existing_ad(product)
+        if existing_ad:
+            return existing_ad, "stored"
+
+    prompt, reviews = build_prompt(product)
+
+    cached_ad, context = lookup_generation(product, prompt, reviews)
+    if cached_ad:
+        _try_store_ad(product, cached_ad)
+        return cached_ad, "cache"
+
+    try:
+        # Some projects or API plans do not support every model name; the one that last
+        # worked for this key is tried first and models with an open circuit are skipped fast
+        ad_text, model_name, last_error = None, None, None
+        for i, name in enumerate(candidate_models()):
+            if i:
+                metrics.incr("fallbacks", stage="generate", model=name)
             try:
-                model = genai.GenerativeModel("text-bison@001")
-                response = model.generate_content(prompt)
-                ad_text = response.text if hasattr(response, "text") else None
-            except Exception as inner_e:
-                # Re-raise the inner exception to be caught by outer handler and trigger fallback
-                raise inner_e
+                ad_text = generate_with_model(name, prompt)
+            except Exception as e:
+                last_error = e
+                continue
+            if ad_text:
+                model_name = name
+                break
 
         if not ad_text:
-            raise RuntimeError("Empty response from generative model")
+            raise last_error or RuntimeError("Empty response from generative model")
 
         if product.lower() not in ad_text.lower():
             print("⚠️ Warning: The generated ad does not appear to mention the product properly.")
 
-        # Store the generated ad in Pinecone for future retrieval
-        store_ad_in_pinecone(product, ad_text)
-        return ad_text
+        remember_generation(model_name, product, prompt, ad_text, context)
+        # Store the generated ad in Pinecone for future retrieval; a vector store outage
+        # (e.g. an open circuit) must not throw away a good ad for the template
+        _try_store_ad(product, ad_text)
+        return ad_text, model_name
 
     except Exception as e:
         print(f"❌ Gemini API Error or unsupported model: {e}")
         print("⚠️ Falling back to local/template ad generator.")
-        # Local fallback: simple template-based RAG-style generation using retrieved reviews
-        def local_generate_ad(product_name, reviews_list):
-            # Basic heuristics: pick up to 3 strongest review snippets and build a short ad
-            snippets = []
-            if isinstance(reviews_list, str):
-                text = reviews_list
-                # split into sentences and take the first few non-empty ones
-                parts = [s.strip() for s in text.replace('\n', ' ').split('.') if s.strip()]
-                snippets = parts[:3]
-            elif isinstance(reviews_list, list):
-                # take first sentence from each review up to 3
-                for r in reviews_list:
-                    if not r:
-                        continue
-                    s = r.replace('\n', ' ').strip()
-                    # use up to first 200 chars
-                    snippets.append(s[:200])
-                    if len(snippets) >= 3:
-                        break
-
-            # Compose ad
-            headline = f"Try {product_name} — Loved by customers"
-            body = " ".join(snippets) if snippets else f"Discover why customers love {product_name}."
-            cta = "Buy now and enjoy the difference!"
-            ad = f"{headline}\n\n{body}\n\n{cta}"
-            return ad
-
-        # Build fallback ad using reviews_text (string) or reviews list
-        fallback_ad = local_generate_ad(product, reviews)
+        metrics.incr("fallbacks", stage="generate", model="template")
+        # Build fallback ad using the retrieved reviews list
+        with metrics.span("generate", model="template"):
+            fallback_ad = local_generate_ad(product, reviews)
+        _try_store_ad(product, fallback_ad)
+        return fallback_ad, "template"
+
+_pending_stores = []
+_pending_stores_lock = threading.Lock()
+
+def _store_in_background(product, ad_text, store):
+    """Persists a finished ad on a background thread so the caller is not kept waiting."""
+    thread = threading.Thread(target=store, args=(product, ad_text), name="ad-store", daemon=True)
+    with _pending_stores_lock:
+        _pending_stores[:] = [t for t in _pending_stores if t.is_alive()]
+        _pending_stores.append(thread)
+    thread.start()
+
+def wait_for_pending_stores(timeout=None):
+    """Blocks until ads handed to background storage have been written."""
+    with _pending_stores_lock:
+        threads = list(_pending_stores)
+    for thread in threads:
+        thread.join(timeout)
+
+def generate_ad_stream(product, force_regenerate=False):
+    """
+    Streaming variant of `generate_ad`: yields the ad text in chunks as Gemini produces them.
+
+    A stored ad is yielded in one piece. If a model fails before sending any text the
+    next one is tried, ending with the template fallback. Once the stream finishes the
+    complete ad is stored in the background (see `wait_for_pending_stores`); an ad
+    whose stream broke off part-way is not stored.
+    """
+    if not force_regenerate:
+        existing_ad = find_existing_ad(product)
+        if existing_ad:
+            yield existing_ad
+            return
+
+    prompt, reviews = build_prompt(product)
+
+    cached_ad, context = lookup_generation(product, prompt, reviews)
+    if cached_ad:
+        yield cached_ad
+        _store_in_background(product, cached_ad, _try_store_ad)
+        return
+
+    last_error = None
+    for i, model_name in enumerate(candidate_models()):
+        if i:
+            metrics.incr("fallbacks", stage="generate", model=model_name)
+        chunks = []
+        complete = True
         try:
-            store_ad_in_pinecone(product, fallback_ad)
-        except Exception as store_exc:
-            print(f"⚠️ Warning: failed to store ad in Pinecone: {store_exc}")
-        return fallback_ad
+            for text in stream_with_model(model_name, prompt):
+                chunks.append(text)
+                yield text
+        except Exception as e:
+            if chunks:
+                # Text already reached the caller; keep what was streamed rather than mixing models
+                print(f"\n⚠️ Stream from {model_name} was interrupted: {e}")
+                complete = False
+            else:
+                last_error = e
+                continue
+        if not chunks:
+            last_error = RuntimeError("Empty response from generative model")
+            continue
+
+        ad_text = "".join(chunks)
+        if product.lower() not in ad_text.lower():
+            print("\n⚠️ Warning: The generated ad does not appear to mention the product properly.")
+        if complete:
+            remember_generation(model_name, product, prompt, ad_text, context)
+            _store_in_background(product, ad_text, _try_store_ad)
+        else:
+            # A truncated ad must not become the product's stored ad
+            print("⚠️ Not storing the incomplete ad.")
+        return
+
+    print(f"❌ Gemini API Error or unsupported model: {last_error}")
+    print("⚠️ Falling back to local/template ad generator.")
+    metrics.incr("fallbacks", stage="generate", model="template")
+    with metrics.span("generate", model="template"):
+        fallback_ad = local_generate_ad(product, reviews)
+    yield fallback_ad
+    _store_in_background(product, fallback_ad, _try_store_ad)
@@ -0,0 +1,113 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ad_generator import generate_ad_with_source
+
+BATCH_WORKERS = 4
+
+
+def read_products(path):
+    """
+    Reads product names from a CSV, JSONL or plain text file.
+
+    CSV files use the `product` column if there is one; otherwise the file is
+    treated as headerless and the first column is used. JSONL lines use
+    their `product` field. Blank entries are skipped.
+    """
+    products = []
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if extension == ".csv":
+            reader = csv.reader(f)
+            header = next(reader, [])
+            column = header.index("product") if "product" in header else 0
+            if "product" not in header and header:
+                products.append(header[column])  # No header row; the first line is data
+            products.extend(row[column] for row in reader if len(row) > column)
+        elif extension in (".jsonl", ".ndjson"):
+            for line in f:
+                if line.strip():
+                    products.append(json.loads(line)["product"])
+        else:
+            products.extend(f)
+    return [p.strip() for p in products if p and p.strip()]
+
+
+def load_statuses(output_path):
+    """Status per product in `output_path`: "ok" once any run succeeded, otherwise the latest ("fallback" or "error")."""
+    statuses = {}
+    if not os.path.exists(output_path):
+        return statuses
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Partially written line from an interrupted run
+            if statuses.get(record["product"]) != "ok":
+                statuses[record["product"]] = record.get("status")
+    return statuses
+
+
+def load_checkpoint(output_path):
+    """Products that already have a successful result in `output_path`."""
+    return {product for product, status in load_statuses(output_path).items() if status == "ok"}
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def run_batch(input_path, output_path, workers=BATCH_WORKERS, force_regenerate=False):
+    """
+    Generates ads for every product in `input_path` on a bounded worker pool.
+
+    Results are appended to `output_path` as JSON lines as soon as each one
+    finishes; that file doubles as the checkpoint, so re-running the same
+    command skips products that already succeeded. Ads that fell back to the
+    local template are recorded with status "fallback" and regenerated on the
+    next run. Model clients and per-model rate limits are shared across workers
+    by `ad_generator`.
+    """
+    products = list(dict.fromkeys(read_products(input_path)))
+    statuses = load_statuses(output_path)
+    pending = [p for p in products if statuses.get(p) != "ok"]
+    # The template ad was stored as the product's ad, so skip the stored-ad lookup for these
+    retry_fallbacks = {p for p in pending if statuses.get(p) == "fallback"}
+    print(f"📋 {len(products)} products, {len(products) - len(pending)} already done, {len(pending)} to generate.")
+    if not pending:
+        return
+
+    started = time.perf_counter()
+    completed = 0
+
+    def generate(product):
+        t0 = time.perf_counter()
+        try:
+            ad_text, source = generate_ad_with_source(
+                product, force_regenerate=force_regenerate or product in retry_fallbacks
+            )
+            status = "fallback" if source == "template" else "ok"
+            return {"product": product, "status": status, "source": source, "ad_text": ad_text,
+                    "seconds": round(time.perf_counter() - t0, 3)}
+        except Exception as e:
+            return {"product": product, "status": "error", "error": str(e), "seconds": round(time.perf_counter() - t0, 3)}
+
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        if out.tell() and not _ends_with_newline(output_path):
+            out.write("\n")  # Terminate a line left half-written by a crash
+        futures = [pool.submit(generate, product) for product in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            completed += 1
+            rate = completed / (time.perf_counter() - started)
+            marker = {"ok": "✅", "fallback": "⚠️"}.get(record["status"], "❌")
+            print(f"{marker} ({completed}/{len(pending)}) {record['product']} [{rate:.2f} ads/s]")
@@ -11,4 +11,58 @@ PINECONE_ENV = os.getenv("PINECONE_ENV", "us-east-1")
 PINECONE_INDEX_NAME = "web-scraped-data"
 PINECONE_ADS_INDEX_NAME = "generated-ad"
 
+CACHE_DIR = os.getenv("MARKPAL_CACHE_DIR", ".markpal_cache")
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIR, "embeddings.sqlite"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
 
+# Vector store backend: "pinecone", "local" (NumPy index persisted under LOCAL_INDEX_DIR) or "memory"
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join(CACHE_DIR, "indexes"))
+LOCAL_INDEX_PERSIST_EVERY = int(os.getenv("LOCAL_INDEX_PERSIST_EVERY", "1000"))  # Unsaved vector writes before a local index is saved
+AD_CACHE_TTL = float(os.getenv("AD_CACHE_TTL", "300"))  # Seconds an exact-key ad lookup stays cached in-process
+
+# Per-model generation quotas (requests per minute) shared by every caller in the process
+GENERATION_REQUESTS_PER_MINUTE = {
+    "gemini-1.5-flash": float(os.getenv("GEMINI_FLASH_RPM", "15")),
+    "text-bison@001": float(os.getenv("TEXT_BISON_RPM", "60")),
+}
+INGEST_STATE_PATH = os.getenv("INGEST_STATE_PATH", os.path.join(CACHE_DIR, "ingest.sqlite"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", os.path.join(CACHE_DIR, "search.sqlite"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(24 * 3600)))  # Seconds a cached search stays fresh
+SEARCH_REQUESTS_PER_MINUTE = float(os.getenv("SEARCH_REQUESTS_PER_MINUTE", "100"))  # Custom Search per-minute quota
+
+# Per-stage timing spans, counters and histograms (see metrics.py); off unless enabled
+METRICS_ENABLED = os.getenv("MARKPAL_METRICS", "false").lower() == "true"
+METRICS_PATH = os.getenv("MARKPAL_METRICS_PATH")  # Export file: *.prom for Prometheus text, otherwise JSON lines
+
+# Cache of LLM generations keyed on (model, normalised prompt), with near-duplicate
+# matching on the retrieved reviews' embedding (similarity 0 disables that part)
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE", "true").lower() == "true"
+GENERATION_CACHE_PATH = os.getenv("GENERATION_CACHE_PATH", os.path.join(CACHE_DIR, "generations.sqlite"))
+GENERATION_CACHE_TTL = float(os.getenv("GENERATION_CACHE_TTL", str(7 * 24 * 3600)))
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "5000"))
+GENERATION_CACHE_SIMILARITY = float(os.getenv("GENERATION_CACHE_SIMILARITY", "0.97"))
+
+# Shared resilience settings for remote calls (see resilience.py)
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))  # Consecutive failures that open a circuit
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))  # How long an open circuit rejects calls
+EMBED_DEADLINE = float(os.getenv("EMBED_DEADLINE", "20"))  # Seconds before giving up on Gemini and embedding locally
+GENERATION_DEADLINE = float(os.getenv("GENERATION_DEADLINE", "60"))
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", "10"))
+VECTOR_STORE_DEADLINE = float(os.getenv("VECTOR_STORE_DEADLINE", "15"))
+# Start a duplicate request when the first has not answered after this many seconds (0 disables hedging)
+GENERATION_HEDGE_AFTER = float(os.getenv("GENERATION_HEDGE_AFTER", "0"))
+SEARCH_HEDGE_AFTER = float(os.getenv("SEARCH_HEDGE_AFTER", "0"))
+MODEL_PREFERENCE_PATH = os.getenv("MODEL_PREFERENCE_PATH", os.path.join(CACHE_DIR, "model_preference.json"))
+MODEL_DEMOTION_TTL = float(os.getenv("MODEL_DEMOTION_TTL", str(24 * 3600)))  # Seconds before a demoted model is tried first again
+
+# Batch ingestion job mode (see ingest_jobs.py)
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", os.path.join(CACHE_DIR, "ingest_queue.sqlite"))
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "600"))  # A crashed worker's shard is reclaimed after this
+INGEST_SHARD_SIZE = int(os.getenv("INGEST_SHARD_SIZE", "20"))  # Tasks a worker claims at once
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_MAX_PENDING_PAGES = int(os.getenv("INGEST_MAX_PENDING_PAGES", "2000"))  # Searches pause while this many pages wait
+INGEST_URLS_PER_PRODUCT = int(os.getenv("INGEST_URLS_PER_PRODUCT", "5"))
+# Set when workers on several hosts share the queue file over a network filesystem (WAL needs local shared memory)
+INGEST_QUEUE_SHARED = os.getenv("INGEST_QUEUE_SHARED", "false").lower() == "true"
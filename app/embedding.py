@@ -1,21 +1,86 @@
+import importlib.util
 import os
 import re
+import queue
+import threading
 import time
+from concurrent.futures import Future
+
 import requests
 from dotenv import load_dotenv
 
+import metrics
+from config import EMBED_DEADLINE
+from embedding_cache import get_embedding_cache
+from resilience import CircuitOpenError, call, is_transient
+from rate_limit import TokenBucket
+
 # Load API key from environment variable
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 USE_LOCAL_EMBEDDING = os.getenv("USE_LOCAL_EMBEDDING", "false").lower() == "true"
+EMBED_DEBUG = os.getenv("EMBED_DEBUG", "false").lower() == "true"
+
+GEMINI_EMBED_MODEL = "models/embedding-001"
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")  # Overridden by the offline benchmark
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))  # batchEmbedContents accepts up to 100 requests
+EMBED_REQUESTS_PER_MINUTE = float(os.getenv("EMBED_REQUESTS_PER_MINUTE", "30"))
+EMBED_BURST = int(os.getenv("EMBED_BURST", "5"))
+EMBED_COALESCE_MS = float(os.getenv("EMBED_COALESCE_MS", "50"))
+
+# Shared limiter for every call to the Gemini embedding API (replaces the fixed post-request sleep)
+EMBED_RATE_LIMITER = TokenBucket.per_minute(EMBED_REQUESTS_PER_MINUTE, burst=EMBED_BURST)
+
+LOCAL_EMBED_MODEL = "all-mpnet-base-v2"
+LOCAL_EMBED_DEVICE = os.getenv("LOCAL_EMBED_DEVICE")  # e.g. "cpu" or "cuda"; detected when unset
+LOCAL_EMBED_BATCH_SIZE = int(os.getenv("LOCAL_EMBED_BATCH_SIZE", "0"))  # 0 = device default
+LOCAL_EMBED_WORKERS = int(os.getenv("LOCAL_EMBED_WORKERS", "0"))  # >0 runs the model in worker processes
+
+# Capability check only; the model itself is loaded on first use by get_local_model()
+LOCAL_EMBEDDING_AVAILABLE = importlib.util.find_spec("sentence_transformers") is not None
+LOCAL_MODEL = None
+LOCAL_ENCODER_POOL = None
+_local_model_lock = threading.Lock()
+
+def get_local_model():
+    """Loads the local sentence-transformers model once, thread-safely; None if it isn't installed."""
+    global LOCAL_MODEL
+    if LOCAL_MODEL is None and LOCAL_EMBEDDING_AVAILABLE:
+        with _local_model_lock:
+            if LOCAL_MODEL is None:
+                from sentence_transformers import SentenceTransformer
+                # 768-dimensional model to match Pinecone index
+                LOCAL_MODEL = SentenceTransformer(LOCAL_EMBED_MODEL, device=LOCAL_EMBED_DEVICE)
+                print("✅ Loaded local embedding model (all-mpnet-base-v2 - 768 dimensions)")
+    return LOCAL_MODEL
+
+def get_local_encoder_pool():
+    """The shared worker-process encoder when LOCAL_EMBED_WORKERS > 0, otherwise None."""
+    global LOCAL_ENCODER_POOL
+    if LOCAL_ENCODER_POOL is None and LOCAL_EMBED_WORKERS > 0 and LOCAL_EMBEDDING_AVAILABLE:
+        with _local_model_lock:
+            if LOCAL_ENCODER_POOL is None:
+                from local_encoder import LocalEncoderPool
+                LOCAL_ENCODER_POOL = LocalEncoderPool(
+                    LOCAL_EMBED_MODEL,
+                    workers=LOCAL_EMBED_WORKERS,
+                    device=LOCAL_EMBED_DEVICE,
+                    batch_size=LOCAL_EMBED_BATCH_SIZE or None,
+                )
+                print(f"✅ Started {LOCAL_ENCODER_POOL.workers} local embedding worker process(es)")
+    return LOCAL_ENCODER_POOL
 
-# Try to import sentence-transformers for local embedding
-try:
-    from sentence_transformers import SentenceTransformer
-    LOCAL_MODEL = SentenceTransformer('all-mpnet-base-v2')  # 768-dimensional model to match Pinecone index
-    print("✅ Loaded local embedding model (all-mpnet-base-v2 - 768 dimensions)")
-except ImportError:
-    LOCAL_MODEL = None
+def check_embedding_capabilities():
+    """Startup check: returns a list of warnings about missing embedding backends."""
+    warnings = []
+    if not LOCAL_EMBEDDING_AVAILABLE:
+        if GEMINI_API_KEY is None:
+            warnings.append("GEMINI_API_KEY is not set and sentence-transformers is not installed; embeddings will fail. "
+                            "Set the key or run `pip install sentence-transformers`.")
+        else:
+            warnings.append("sentence-transformers is not installed; there is no local fallback if the Gemini "
+                            "embedding API fails. Run `pip install sentence-transformers` to enable it.")
+    return warnings
 
 def clean_text(text, max_length=5000):
     """Pre-process text before embedding: removes unwanted characters and limits length."""
@@ -25,69 +90,257 @@ def clean_text(text, max_length=5000):
     text = re.sub(r'\s+', ' ', text).strip()  # Remove extra spaces
     return text[:max_length]  # Truncate if too long
 
-def get_embedding(text, max_retries=5):
-    """Generate an embedding using the Google Gemini API with retry logic, or fallback to local embedding."""
-    
-    if GEMINI_API_KEY is None:
-        print("⚠️  GEMINI_API_KEY not set. Using local embedding fallback...")
-        return get_local_embedding(text)
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/embedding-001:embedContent?key={GEMINI_API_KEY}"
+def _is_quota_error(error):
+    error_str = str(error)
+    return "429" in error_str or "quota" in error_str.lower() or "RESOURCE_EXHAUSTED" in error_str or "403" in error_str
+
+def _post_embed_batch(texts):
+    """Embeds up to EMBED_BATCH_SIZE cleaned texts with a single batchEmbedContents request."""
+    url = f"{GEMINI_API_BASE}/v1beta/{GEMINI_EMBED_MODEL}:batchEmbedContents?key={GEMINI_API_KEY}"
     headers = {"Content-Type": "application/json"}
+    data = {
+        "requests": [
+            {"model": GEMINI_EMBED_MODEL, "content": {"parts": [{"text": text}]}}
+            for text in texts
+        ]
+    }
+    EMBED_RATE_LIMITER.acquire()
+    metrics.incr("api_calls", service="gemini_embed")
+    with metrics.span("embed", backend="gemini"):
+        response = requests.post(url, headers=headers, json=data, timeout=EMBED_DEADLINE)
+        response.raise_for_status()
+        return [item["values"] for item in response.json()["embeddings"]]
+
+def _should_retry_embed(error):
+    # Quota errors will not clear within the deadline; embed locally straight away
+    return is_transient(error) and not _is_quota_error(error)
 
+def _embed_chunk(texts, max_retries):
+    """
+    Embeds one batch remotely, falling back to local embedding.
+
+    Transient errors are retried with jittered backoff within EMBED_DEADLINE;
+    quota errors and an open "gemini_embed" circuit go straight to the local model.
+    Returns (vectors, remote) where `remote` tells whether Gemini produced them.
+    """
     try:
-        text = clean_text(text)  # Clean input text
-    except ValueError as e:
-        print(f"Preprocessing Error: {e}")
-        return None  
+        vectors = call(
+            "gemini_embed",
+            _post_embed_batch,
+            texts,
+            retries=max(0, max_retries - 1),
+            deadline=EMBED_DEADLINE,
+            retryable=_should_retry_embed,
+        )
+        return vectors, True
+    except CircuitOpenError:
+        metrics.incr("fallbacks", stage="embed", reason="circuit_open")
+        return get_local_embeddings(texts), False
+    except requests.exceptions.RequestException as e:
+        if _is_quota_error(e):
+            print(f"⚠️  Gemini API error ({e}). Falling back to local embedding...")
+            metrics.incr("fallbacks", stage="embed", reason="quota")
+        else:
+            print(f"⚠️  Gemini embedding failed ({e}). Falling back to local embedding...")
+            metrics.incr("fallbacks", stage="embed", reason="retries_exhausted")
+        return get_local_embeddings(texts), False
 
-    data = {
-        "content": {"parts": [{"text": text}]}
-    }
+def get_embeddings(texts, max_retries=5):
+    """
+    Generate embeddings for many texts, packing up to EMBED_BATCH_SIZE texts into
+    each Gemini batchEmbedContents request.
+
+    Returns a list aligned with `texts`; entries whose text is invalid are None.
+    """
+    texts = list(texts)
+    results = [None] * len(texts)
 
-    for attempt in range(max_retries):
+    cleaned = []
+    for i, text in enumerate(texts):
         try:
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            time.sleep(2)  # Add delay after successful request to avoid rate limits
-            return response.json()["embedding"]["values"]  # Extract embedding vector
-
-        except requests.exceptions.RequestException as e:
-            error_str = str(e)
-            
-            # Check for rate limit or quota errors
-            if "429" in error_str or "quota" in error_str.lower() or "RESOURCE_EXHAUSTED" in error_str or "403" in error_str:
-                print(f"⚠️  Gemini API error ({e}). Falling back to local embedding...")
-                return get_local_embedding(text)
-            
-            # For other errors, retry with exponential backoff
-            if attempt < max_retries - 1:
-                wait_time = 3 ** attempt
-                print(f"API error: {e}. Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
+            cleaned.append((i, clean_text(text)))  # Clean input text
+        except ValueError as e:
+            print(f"Preprocessing Error: {e}")
+
+    if GEMINI_API_KEY is None:
+        if cleaned:
+            print("⚠️  GEMINI_API_KEY not set. Using local embedding fallback...")
+            metrics.incr("fallbacks", stage="embed", reason="no_api_key")
+        local = get_local_embeddings([text for _, text in cleaned])
+        for (i, _), vector in zip(cleaned, local):
+            results[i] = vector
+        return results
+
+    # Serve repeated texts from the persistent cache and only send the misses
+    cache = get_embedding_cache()
+    if cache is not None and cleaned:
+        cached = cache.get_many(GEMINI_EMBED_MODEL, [text for _, text in cleaned])
+        misses = []
+        for (i, text), vector in zip(cleaned, cached):
+            if vector is None:
+                misses.append((i, text))
             else:
-                print(f"⚠️  Max retries exceeded. Falling back to local embedding...")
-                return get_local_embedding(text)
-    
-    print("Falling back to local embedding...")
-    return get_local_embedding(text)
+                results[i] = vector
+        metrics.incr("cache_hits", len(cleaned) - len(misses), cache="embedding")
+        cleaned = misses
 
-def get_local_embedding(text):
-    """Fallback: Generate embedding using local sentence-transformers model (768-dimensional)."""
-    global LOCAL_MODEL
-    
-    if LOCAL_MODEL is None:
-        print("⚠️  Local embedding model not available. Installing sentence-transformers...")
-        import subprocess
-        subprocess.check_call(["pip", "install", "sentence-transformers"])
-        from sentence_transformers import SentenceTransformer
-        LOCAL_MODEL = SentenceTransformer('all-mpnet-base-v2')  # 768-dimensional model
-    
+    for start in range(0, len(cleaned), EMBED_BATCH_SIZE):
+        chunk = cleaned[start:start + EMBED_BATCH_SIZE]
+        chunk_texts = [text for _, text in chunk]
+        vectors, remote = _embed_chunk(chunk_texts, max_retries)
+        if remote:
+            metrics.incr("texts_embedded", len(chunk_texts), backend="gemini")
+            if cache is not None:
+                cache.put_many(GEMINI_EMBED_MODEL, chunk_texts, vectors)
+        for (i, _), vector in zip(chunk, vectors):
+            results[i] = vector
+    return results
+
+class EmbeddingCoalescer:
+    """
+    Merges concurrent single-text embedding requests into batched calls.
+
+    Callers get a Future per text; a background thread drains the queue. A lone
+    request is sent straight away; when others are already queued it waits at
+    most `max_wait` seconds for the batch to fill. Requests that arrive while a
+    batch is in flight go out together in the next one.
+    """
+
+    def __init__(self, embed_batch, max_batch_size=EMBED_BATCH_SIZE, max_wait=EMBED_COALESCE_MS / 1000.0):
+        self._embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-coalescer", daemon=True)
+                self._thread.start()
+
+    def submit(self, text):
+        """Queues `text` for embedding and returns a Future for its vector."""
+        future = Future()
+        self._queue.put((text, future))
+        self._ensure_worker()
+        return future
+
+    def embed(self, text):
+        """Embeds a single text through the shared batch queue, blocking for the result."""
+        return self.submit(text).result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Serial callers (nothing else queued) skip the coalescing window
+            deadline = time.monotonic() + (self.max_wait if not self._queue.empty() else 0)
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                vectors = self._embed_batch([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+_coalescer = EmbeddingCoalescer(get_embeddings)
+
+def get_embedding(text, max_retries=None):
+    """
+    Generate an embedding using the Google Gemini API with retry logic, or fallback to local embedding.
+
+    With the default `max_retries=None` the request goes through the shared
+    coalescing queue; an explicit value embeds this text on its own with that many attempts.
+    """
+    if max_retries is not None:
+        return get_embeddings([text], max_retries=max_retries)[0]
+
+    # Cache hits return immediately instead of waiting for the coalescing window
+    cache = get_embedding_cache()
+    if cache is not None and GEMINI_API_KEY is not None:
+        try:
+            # The miss is counted by get_embeddings' own lookup
+            vector = cache.get(GEMINI_EMBED_MODEL, clean_text(text), count_misses=False)
+        except ValueError:
+            vector = None
+        if vector is not None:
+            metrics.incr("cache_hits", cache="embedding")
+            return vector
+    # Concurrent callers share batched requests through the coalescing queue
+    return _coalescer.embed(text)
+
+def get_local_embeddings(texts, batch_size=None):
+    """
+    Batched local embedding with the sentence-transformers model (768-dimensional).
+
+    Cache misses are length-sorted and encoded in `batch_size` batches (a device
+    default when unset), in the worker-process pool if LOCAL_EMBED_WORKERS > 0.
+    Returns float32 arrays aligned with `texts`; invalid texts give None.
+    """
+    import numpy as np
+    from local_encoder import default_batch_size, encode_sorted
+
+    texts = list(texts)
+    results = [None] * len(texts)
+    cleaned = []
+    for i, text in enumerate(texts):
+        try:
+            cleaned.append((i, clean_text(text)))
+        except ValueError as e:
+            print(f"❌ Local embedding failed: {e}")
+
+    cache = get_embedding_cache()
+    if cache is not None and cleaned:
+        cached = cache.get_many(LOCAL_EMBED_MODEL, [text for _, text in cleaned])
+        misses = []
+        for (i, text), vector in zip(cleaned, cached):
+            if vector is None:
+                misses.append((i, text))
+            else:
+                results[i] = np.asarray(vector, dtype=np.float32)
+        cleaned = misses
+    if not cleaned:
+        return results
+
+    miss_texts = [text for _, text in cleaned]
     try:
-        text = clean_text(text)
-        embedding = LOCAL_MODEL.encode(text, convert_to_tensor=False)
-        print(f"✅ Using local embedding (dimension: {len(embedding)})")
-        return embedding.tolist()
+        with metrics.span("embed", backend="local") as span:
+            pool = get_local_encoder_pool()
+            if pool is not None:
+                span.set(workers="pool")
+                matrix = pool.encode(miss_texts)
+            else:
+                model = get_local_model()
+                if model is None:
+                    print("❌ Local embedding model not available (sentence-transformers is not installed).")
+                    return results
+                batch_size = batch_size or LOCAL_EMBED_BATCH_SIZE or default_batch_size(str(model.device))
+                matrix = encode_sorted(model, miss_texts, batch_size)
+        metrics.incr("texts_embedded", len(miss_texts), backend="local")
     except Exception as e:
         print(f"❌ Local embedding failed: {e}")
-        return None
+        return results
+
+    if EMBED_DEBUG:
+        print(f"🔧 Debug - Local embedding for {len(miss_texts)} text(s) (dimension: {matrix.shape[1]})")
+    if cache is not None:
+        cache.put_many(LOCAL_EMBED_MODEL, miss_texts, matrix)
+    for (i, _), vector in zip(cleaned, matrix):
+        results[i] = vector
+    return results
+
+def get_local_embedding(text):
+    """Fallback: Generate embedding using local sentence-transformers model (768-dimensional)."""
+    return get_local_embeddings([text])[0]
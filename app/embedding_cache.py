@@ -0,0 +1,164 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from config import EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES
+
+# Counting rows is a table scan, so the LRU limit is enforced every N writes
+EVICT_CHECK_INTERVAL = 256
+
+
+def _pack(vector):
+    """float32 bytes for a list or a NumPy array."""
+    if hasattr(vector, "astype"):
+        return vector.astype("float32").tobytes()
+    return array("f", vector).tobytes()
+
+
+def cache_key(model_id, text):
+    """Content address for an embedding: hash of the model id and the cleaned text."""
+    return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Disk-backed, content-addressed embedding cache.
+
+    Vectors are stored as packed float32 blobs in SQLite, keyed by
+    `cache_key(model_id, text)`. When the table grows past `max_entries`
+    the least recently used rows are evicted.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def get_many(self, model_id, texts, count_misses=True):
+        """
+        Returns a list aligned with `texts` holding cached vectors or None for misses.
+
+        With `count_misses=False` only hits go into the stats, for a fast-path
+        lookup whose misses are looked up (and counted) again further on.
+        """
+        keys = [cache_key(model_id, text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            if count_misses:
+                self.misses += len(keys) - len(found)
+
+        results = []
+        for key in keys:
+            blob = found.get(key)
+            if blob is None:
+                results.append(None)
+            else:
+                vector = array("f")
+                vector.frombytes(blob)
+                results.append(vector.tolist())
+        return results
+
+    def get(self, model_id, text, count_misses=True):
+        return self.get_many(model_id, [text], count_misses)[0]
+
+    def put_many(self, model_id, texts, vectors):
+        """Stores vectors for `texts`; None vectors are skipped."""
+        now = time.time()
+        rows = [
+            (cache_key(model_id, text), model_id, _pack(vector), now)
+            for text, vector in zip(texts, vectors)
+            if vector is not None
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._writes_since_evict += len(rows)
+            if self._writes_since_evict >= EVICT_CHECK_INTERVAL:
+                self._evict()
+            self._conn.commit()
+
+    def put(self, model_id, text, vector):
+        self.put_many(model_id, [text], [vector])
+
+    def _evict(self):
+        self._writes_since_evict = 0
+        if not self.max_entries:
+            return
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN"
+                " (SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+
+    def stats(self):
+        """Hit/miss counters and current size."""
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": size,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self.hits = self.misses = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    """Returns the shared process-wide cache, or None when caching is disabled."""
+    global _cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
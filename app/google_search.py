@@ -1,39 +1,185 @@
-import requests
+import hashlib
+import json
 import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
 from dotenv import load_dotenv
 
+import metrics
+from config import SEARCH_CACHE_PATH, SEARCH_CACHE_TTL, SEARCH_DEADLINE, SEARCH_HEDGE_AFTER, SEARCH_REQUESTS_PER_MINUTE
+from rate_limit import TokenBucket
+from resilience import CircuitOpenError, call
+
 # Explicitly load .env file
 load_dotenv()
 
 API_KEY = os.getenv("GOOGLE_SEARCH_API")
 CX_ID = os.getenv("GOOGLE_CSE_ID")
+SEARCH_DEBUG = os.getenv("SEARCH_DEBUG", "false").lower() == "true"
 
-def google_search(query, num_results=5):
-    """Search Google Custom Search API and return a list of URLs."""
-    print(f"🔧 Debug - Using API Key: {API_KEY[:20]}..." if API_KEY else "🔧 Debug - API Key: NOT SET")
-    print(f"🔧 Debug - Using CX ID: {CX_ID}")
-    print(f"🔧 Debug - Query: {query}\n")
-    
-    url = f"https://customsearch.googleapis.com/customsearch/v1"
+SEARCH_URL = os.getenv("GOOGLE_SEARCH_URL", "https://customsearch.googleapis.com/customsearch/v1")
+PAGE_SIZE = 10  # Custom Search returns at most 10 results per request
+MAX_RESULTS = 100  # ...and never more than 100 results for a query
+
+# Shared by every search request in the process (ingest workers swap in a cross-process bucket)
+SEARCH_RATE_LIMITER = TokenBucket.per_minute(SEARCH_REQUESTS_PER_MINUTE)
+
+
+class SearchCache:
+    """Persistent query -> URLs cache with a per-entry TTL, stored in SQLite."""
+
+    def __init__(self, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL):
+        self.ttl = ttl
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS searches (key TEXT PRIMARY KEY, urls TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT urls, created_at FROM searches WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, urls):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO searches (key, urls, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(urls), time.time()),
+            )
+            self._conn.commit()
+
+
+_cache = None
+_inflight = {}
+_lock = threading.Lock()
+
+
+def _get_cache():
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = SearchCache()
+        return _cache
+
+
+def _cache_key(query, num_results):
+    normalized = " ".join(query.lower().split())
+    return hashlib.sha256(json.dumps([normalized, num_results, CX_ID]).encode("utf-8")).hexdigest()
+
+
+def _fetch_page(query, start, count):
+    """
+    Custom Search results `start`..`start + count - 1` (1-based), through the
+    "google_search" circuit breaker with jittered retries and optional hedging.
+    """
+    return call(
+        "google_search",
+        _request_page,
+        query,
+        start,
+        count,
+        retries=2,
+        deadline=SEARCH_DEADLINE,
+        hedge_after=SEARCH_HEDGE_AFTER or None,
+    )
+
+
+def _request_page(query, start, count):
     params = {
         "q": query,
         "cx": CX_ID,
-        "num": num_results,
+        "num": count,
+        "start": start,
         "key": API_KEY,
     }
+    SEARCH_RATE_LIMITER.acquire()
+    metrics.incr("api_calls", service="search")
+    response = requests.get(SEARCH_URL, params=params, timeout=SEARCH_DEADLINE)
+    response.raise_for_status()  # Raises an error for HTTP codes 4xx/5xx
+    data = response.json()
+    return [item["link"] for item in data.get("items", [])]
+
+
+def _search(query, num_results):
+    """Fetches every page needed for `num_results` results in parallel and merges them in rank order."""
+    num_results = min(num_results, MAX_RESULTS)
+    pages = [(start, min(PAGE_SIZE, num_results - start + 1)) for start in range(1, num_results + 1, PAGE_SIZE)]
+    if len(pages) == 1:
+        results = [_fetch_page(query, *pages[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(pages)) as pool:
+            results = list(pool.map(lambda page: _fetch_page(query, *page), pages))
+    urls, seen = [], set()
+    for page in results:
+        for url in page:
+            if url not in seen:
+                seen.add(url)
+                urls.append(url)
+    return urls[:num_results]
+
+
+def google_search(query, num_results=5):
+    """
+    Search Google Custom Search API and return a list of URLs.
+
+    Results are cached on disk for SEARCH_CACHE_TTL seconds, concurrent calls
+    for the same query share one request, and more than 10 results are fetched
+    as parallel pages.
+    """
+    if SEARCH_DEBUG:
+        print(f"🔧 Debug - Query: {query} (CX ID: {CX_ID})")
+    if num_results <= 0:
+        return []
+
+    with metrics.span("search") as span:
+        return _cached_search(query, num_results, span)
+
+
+def _cached_search(query, num_results, span):
+    key = _cache_key(query, num_results)
+    cache = _get_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        span.set(source="cache")
+        metrics.incr("cache_hits", cache="search")
+        return list(cached)
+
+    with _lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+    if not owner:
+        span.set(source="shared")
+        return list(future.result())
+
+    span.set(source="api")
 
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()  # Raises an error for HTTP codes 4xx/5xx
-        
-        data = response.json()
-        
-        if "items" in data:
-            return [item["link"] for item in data["items"]]
+        urls = _search(query, num_results)
+        if urls:
+            cache.put(key, urls)
         else:
             print("❌ No search results found.")
-            return []
-
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, CircuitOpenError, TimeoutError) as e:  # TimeoutError: hedged search ran out of time
         print(f"⚠️ API Request Error: {e}")
-        return []
+        urls = []
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+    future.set_result(urls)
+    return list(urls)
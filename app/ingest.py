@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from config import INGEST_STATE_PATH, LOCAL_INDEX_DIR, PINECONE_API_KEY, PINECONE_INDEX_NAME, VECTOR_BACKEND
+
+CHUNK_SIZE = 800  # Characters per chunk, roughly one review
+CHUNK_OVERLAP = 150
+INGEST_MAX_CHARS = 20000  # Per-page text budget when chunking instead of truncating to one vector
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Splits text into overlapping chunks of about `size` characters.
+
+    Chunk boundaries are moved back to the nearest sentence end (or space) so
+    reviews are not cut mid-sentence; consecutive chunks share `overlap` characters.
+    """
+    text = re.sub(r"\s+", " ", text).strip()
+    if len(text) <= size:
+        return [text] if text else []
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            window = text[start:end]
+            cut = max(window.rfind(". "), window.rfind("! "), window.rfind("? "))
+            if cut > size // 2:
+                end = start + cut + 1
+            else:
+                space = window.rfind(" ")
+                if space > size // 2:
+                    end = start + space
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        next_start = max(end - overlap, start + 1)
+        # Start the overlap on a word boundary
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return chunks
+
+
+def chunk_id(product, url, chunk):
+    """Stable vector ID for a chunk: the same chunk of the same page always maps to the same ID."""
+    digest = hashlib.sha1(f"{product}\0{url}\0{chunk}".encode("utf-8")).hexdigest()[:20]
+    return f"{url}#{digest}"
+
+
+def vector_store_id(backend=VECTOR_BACKEND, index_name=PINECONE_INDEX_NAME):
+    """
+    Names the vector store that ingestion state describes.
+
+    Local indexes are identified by their directory, Pinecone indexes by the
+    project's API key (hashed) and the index name.
+    """
+    if backend == "local":
+        return f"local:{os.path.abspath(os.path.join(LOCAL_INDEX_DIR, index_name))}"
+    if backend == "memory":
+        return "memory"
+    project = hashlib.sha256((PINECONE_API_KEY or "").encode("utf-8")).hexdigest()[:12]
+    return f"{backend}:{project}:{index_name}"
+
+
+class IngestState:
+    """
+    SQLite record of what has been ingested per (url, product) into one vector store.
+
+    Keeps the HTTP validators for conditional re-fetches, the hash of the
+    extracted page text and the IDs of the chunks stored for it. Rows are keyed
+    by `store` (see `vector_store_id`), so switching backend, index or Pinecone
+    project re-ingests pages instead of skipping them as unchanged.
+    """
+
+    def __init__(self, path=INGEST_STATE_PATH, store=None):
+        self.store = store if store is not None else vector_store_id()
+        if self.store == "memory":
+            path = ":memory:"  # The in-process index is thrown away at exit, so its state must be too
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Rows of the old `pages` table never recorded which store they describe, so they can't be trusted
+        self._conn.execute("DROP TABLE IF EXISTS pages")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingested_pages ("
+            " store TEXT NOT NULL,"
+            " url TEXT NOT NULL,"
+            " product TEXT NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " content_hash TEXT,"
+            " chunk_ids TEXT NOT NULL DEFAULT '[]',"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (store, url, product))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def is_empty(self):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM ingested_pages WHERE store = ? LIMIT 1", (self.store,)).fetchone()
+        return row is None
+
+    def clear(self):
+        """Forgets everything recorded for this store (e.g. after the index was deleted)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM ingested_pages WHERE store = ?", (self.store,))
+            self._conn.commit()
+
+    def get(self, url, product):
+        """Previous record as a dict, or None for a page never ingested."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_hash, chunk_ids FROM ingested_pages"
+                " WHERE store = ? AND url = ? AND product = ?",
+                (self.store, url, product),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "content_hash": row[2], "chunk_ids": json.loads(row[3])}
+
+    def put(self, url, product, etag, last_modified, page_hash, chunk_ids):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ingested_pages"
+                " (store, url, product, etag, last_modified, content_hash, chunk_ids, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.store, url, product, etag, last_modified, page_hash, json.dumps(chunk_ids), time.time()),
+            )
+            self._conn.commit()
+
+    def touch_validators(self, url, product, etag, last_modified):
+        """Refreshes the HTTP validators of an unchanged page."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ingested_pages SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified),"
+                " updated_at = ? WHERE store = ? AND url = ? AND product = ?",
+                (etag, last_modified, time.time(), self.store, url, product),
+            )
+            self._conn.commit()
+
+
+def plan_page(product, url, text, previous):
+    """
+    Works out what to write for a freshly fetched page.
+
+    Returns (page_hash, chunks, new_chunks, stale_ids): all chunks as
+    (id, text) pairs, the ones not stored yet, and previously stored chunk IDs
+    that no longer exist on the page. An unchanged page yields no new or stale chunks.
+    """
+    page_hash = content_hash(text)
+    chunks = [(chunk_id(product, url, chunk), chunk) for chunk in chunk_text(text)]
+    if previous and previous["content_hash"] == page_hash:
+        return page_hash, chunks, [], []
+    # Pages ingested before chunking were stored as a single vector keyed by the URL
+    known = set(previous["chunk_ids"]) if previous else {url}
+    current = {cid for cid, _ in chunks}
+    new_chunks = [(cid, chunk) for cid, chunk in chunks if cid not in known]
+    stale_ids = sorted(known - current)
+    return page_hash, chunks, new_chunks, stale_ids
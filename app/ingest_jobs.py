@@ -0,0 +1,455 @@
+"""
+Batch ingestion job mode for catalog-scale backfills of the scraped-data index.
+
+Products (and optionally known review URLs) go into a durable SQLite work
+queue. Worker processes claim shards of tasks under a lease, search for
+review pages, then scrape, chunk, embed and upsert them through the same
+incremental pipeline `main()` uses. A crashed worker's lease expires and
+its shard is picked up again; failed tasks are retried up to
+INGEST_MAX_ATTEMPTS times. Workers on other machines can join by pointing
+`--queue` at the same file on a shared volume with working file locks and
+INGEST_QUEUE_SHARED=true on every host, which swaps SQLite's WAL mode (it
+needs shared memory on one host) for the rollback journal.
+
+    python app/ingest_jobs.py enqueue products.csv [--urls pages.csv]
+    python app/ingest_jobs.py work --processes 4
+    python app/ingest_jobs.py status
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+
+from config import (
+    INGEST_QUEUE_PATH,
+    INGEST_LEASE_SECONDS,
+    INGEST_SHARD_SIZE,
+    INGEST_MAX_ATTEMPTS,
+    INGEST_MAX_PENDING_PAGES,
+    INGEST_URLS_PER_PRODUCT,
+    INGEST_QUEUE_SHARED,
+    VECTOR_BACKEND,
+)
+
+IDLE_SLEEP = 5.0  # Seconds a worker waits before polling again when nothing is claimable
+THROUGHPUT_WINDOW = 300.0
+
+# kind: "search" (find review pages for a product) or "page" (ingest one URL)
+Task = namedtuple("Task", ["id", "kind", "product", "url", "attempts"])
+
+
+class WorkQueue:
+    """
+    Durable task queue in SQLite shared by every worker process.
+
+    `claim` hands out shards of pending tasks under a time-limited lease;
+    workers `renew` the lease while they work and `complete` or `fail` the
+    tasks at the end. Leases that run out are reclaimed by the next claim.
+    Searches are only handed out while fewer than `max_pending_pages` pages
+    wait to be ingested, so discovery cannot run far ahead of ingestion.
+    A `shared` queue (used from several hosts) uses the rollback journal
+    instead of WAL, which does not work over a network filesystem.
+    """
+
+    def __init__(self, path=INGEST_QUEUE_PATH, max_attempts=INGEST_MAX_ATTEMPTS,
+                 max_pending_pages=INGEST_MAX_PENDING_PAGES, shared=INGEST_QUEUE_SHARED):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.max_pending_pages = max_pending_pages
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        # The journal mode is stored in the file, so it also applies to the shared rate limit buckets
+        self._conn.execute("PRAGMA journal_mode=DELETE" if shared else "PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " id INTEGER PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " product TEXT NOT NULL,"
+            " url TEXT NOT NULL DEFAULT '',"
+            " status TEXT NOT NULL DEFAULT 'pending',"  # pending, leased, done or failed
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " lease_owner TEXT,"
+            " lease_expires REAL,"
+            " last_error TEXT,"
+            " updated_at REAL NOT NULL,"
+            " UNIQUE (kind, product, url))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, kind)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def add_products(self, products):
+        """Queues a search task per product; returns how many were new."""
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (kind, product, updated_at) VALUES ('search', ?, ?)",
+                [(product, now) for product in products],
+            )
+            return conn.total_changes - before
+
+    def add_pages(self, pages):
+        """Queues (product, url) pages for ingestion; returns how many were new."""
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (kind, product, url, updated_at) VALUES ('page', ?, ?, ?)",
+                [(product, url, now) for product, url in pages],
+            )
+            return conn.total_changes - before
+
+    def claim(self, owner, limit=INGEST_SHARD_SIZE, lease_seconds=INGEST_LEASE_SECONDS):
+        """
+        Leases up to `limit` tasks to `owner`.
+
+        Pages come before searches and are grouped by product, so one shard
+        usually covers a few products' pages that can go through one pipeline run.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._reclaim_expired(conn, now)
+            (pending_pages,) = conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE kind = 'page' AND status = 'pending'"
+            ).fetchone()
+            kinds = ("page", "search") if pending_pages < self.max_pending_pages else ("page",)
+            rows = conn.execute(
+                f"SELECT id, kind, product, url, attempts FROM tasks"
+                f" WHERE status = 'pending' AND kind IN ({','.join('?' * len(kinds))})"
+                f" ORDER BY kind = 'search', product, id LIMIT ?",
+                (*kinds, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?,"
+                " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(owner, now + lease_seconds, now, row[0]) for row in rows],
+            )
+        return [Task(row[0], row[1], row[2], row[3], row[4] + 1) for row in rows]
+
+    def _reclaim_expired(self, conn, now):
+        conn.execute(
+            "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+            " lease_owner = NULL, lease_expires = NULL, last_error = 'lease expired', updated_at = ?"
+            " WHERE status = 'leased' AND lease_expires < ?",
+            (self.max_attempts, now, now),
+        )
+
+    def renew(self, owner, ids, lease_seconds=INGEST_LEASE_SECONDS):
+        """Extends the lease on tasks `owner` still holds."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE tasks SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                [(now + lease_seconds, task_id, owner) for task_id in ids],
+            )
+
+    def complete(self, owner, ids):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE tasks SET status = 'done', lease_owner = NULL, lease_expires = NULL, last_error = NULL,"
+                " updated_at = ? WHERE id = ? AND lease_owner = ?",
+                [(now, task_id, owner) for task_id in ids],
+            )
+
+    def fail(self, owner, ids, error):
+        """Returns tasks to the queue, or marks them failed once they have used up their attempts."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " lease_owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ?"
+                " WHERE id = ? AND lease_owner = ?",
+                [(self.max_attempts, str(error)[:500], now, task_id, owner) for task_id in ids],
+            )
+
+    def retry_failed(self):
+        """Puts every failed task back in the queue with fresh attempts; returns how many."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE tasks SET status = 'pending', attempts = 0, updated_at = ? WHERE status = 'failed'",
+                (time.time(),),
+            ).rowcount
+
+    def counts(self):
+        """{kind: {status: count}} over the whole queue."""
+        counts = defaultdict(lambda: defaultdict(int))
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, status, COUNT(*) FROM tasks GROUP BY kind, status").fetchall()
+        for kind, status, count in rows:
+            counts[kind][status] = count
+        return counts
+
+    def throughput(self, window=THROUGHPUT_WINDOW, started=None):
+        """
+        Pages finished per second over the last `window` seconds, across all workers.
+
+        A job younger than the window is measured over its own age: since
+        `started` when given, otherwise since the first page finished in the window.
+        """
+        now = time.time()
+        with self._lock:
+            done, first_done = self._conn.execute(
+                "SELECT COUNT(*), MIN(updated_at) FROM tasks WHERE kind = 'page' AND status = 'done' AND updated_at > ?",
+                (now - window,),
+            ).fetchone()
+        if not done:
+            return 0.0
+        since = started if started is not None else first_done
+        return done / max(1.0, min(window, now - since))
+
+    def is_drained(self):
+        """True once nothing is pending or leased."""
+        with self._lock:
+            (active,) = self._conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')"
+            ).fetchone()
+        return active == 0
+
+
+class LeaseKeeper:
+    """Renews a shard's lease in the background while a worker is busy with it."""
+
+    def __init__(self, queue, owner, ids, lease_seconds):
+        self.queue = queue
+        self.owner = owner
+        self.ids = ids
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.queue.renew(self.owner, self.ids, self.lease_seconds)
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not renew lease: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def share_rate_limits(queue_path):
+    """Makes this process draw its Gemini embedding and Custom Search quota from buckets shared by all workers."""
+    import embedding
+    import google_search
+    from config import SEARCH_REQUESTS_PER_MINUTE
+    from rate_limit import SharedTokenBucket
+
+    embedding.EMBED_RATE_LIMITER = SharedTokenBucket.per_minute(
+        queue_path, "gemini_embed", embedding.EMBED_REQUESTS_PER_MINUTE, burst=embedding.EMBED_BURST
+    )
+    google_search.SEARCH_RATE_LIMITER = SharedTokenBucket.per_minute(
+        queue_path, "google_search", SEARCH_REQUESTS_PER_MINUTE
+    )
+
+
+def process_shard(queue, owner, shard, state, urls_per_product, fetch_workers):
+    """Runs one claimed shard: searches queue new pages, pages go through the scrape pipeline per product."""
+    from google_search import google_search
+    from pipeline import run_scrape_pipeline
+
+    pages_by_product = defaultdict(list)
+    for task in shard:
+        if task.kind == "page":
+            pages_by_product[task.product].append(task)
+            continue
+        urls = google_search(task.product + " reviews", num_results=urls_per_product)
+        if urls:
+            queue.add_pages((task.product, url) for url in urls)
+            queue.complete(owner, [task.id])
+        else:
+            queue.fail(owner, [task.id], "no search results")
+
+    for product, tasks in pages_by_product.items():
+        run = run_scrape_pipeline([task.url for task in tasks], product, fetch_workers=fetch_workers, state=state)
+        failed = set(run.failed)
+        queue.complete(owner, [task.id for task in tasks if task.url not in failed])
+        if failed:
+            queue.fail(owner, [task.id for task in tasks if task.url in failed], "fetch or store failed")
+
+
+MEMORY_BACKEND_ERROR = (
+    "VECTOR_BACKEND=memory keeps vectors in a throwaway in-process index; ingestion jobs need a "
+    "persistent backend (pinecone or local), or every page would be marked done and lost."
+)
+
+
+def run_worker(queue_path, shard_size, lease_seconds, urls_per_product, fetch_workers, threads=None, log_path=None):
+    """
+    Worker loop: claim a shard, process it under a renewed lease, repeat until
+    the queue is drained. Safe to run in any number of processes at once.
+    Refuses to run on the non-persistent `memory` backend.
+    """
+    if VECTOR_BACKEND == "memory":
+        raise RuntimeError(MEMORY_BACKEND_ERROR)
+    if threads:
+        # Split the CPU between worker processes before torch is imported
+        os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+        os.environ.setdefault("MKL_NUM_THREADS", str(threads))
+    if log_path:
+        sys.stdout = open(log_path, "a", encoding="utf-8", buffering=1)
+        sys.stderr = sys.stdout
+
+    from ingest import IngestState
+
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    queue = WorkQueue(queue_path)
+    share_rate_limits(queue_path)
+    state = IngestState()
+    print(f"👷 Worker {owner} started.")
+    while True:
+        shard = queue.claim(owner, shard_size, lease_seconds)
+        if not shard:
+            if queue.is_drained():
+                print(f"✅ Worker {owner}: queue drained.")
+                return
+            time.sleep(IDLE_SLEEP)
+            continue
+        with LeaseKeeper(queue, owner, [task.id for task in shard], lease_seconds):
+            try:
+                process_shard(queue, owner, shard, state, urls_per_product, fetch_workers)
+            except Exception as e:
+                print(f"❌ Shard failed: {e}")
+                # Tasks already completed are no longer leased by us, so this only touches the rest
+                queue.fail(owner, [task.id for task in shard], e)
+
+
+def format_progress(queue, started=None):
+    counts = queue.counts()
+    pages, searches = counts["page"], counts["search"]
+    total_pages = sum(pages.values())
+    rate = queue.throughput(started=started)
+    line = (
+        f"📊 Pages {pages['done']}/{total_pages} done, {pages['leased']} in progress, {pages['failed']} failed"
+        f" | Searches {searches['done']}/{sum(searches.values())}"
+        f" | {rate * 60:.1f} pages/min"
+    )
+    remaining = pages["pending"] + pages["leased"]
+    if rate > 0 and remaining:
+        line += f", ~{remaining / rate / 60:.0f} min left"
+    if started is not None:
+        line += f" | {time.time() - started:.0f}s elapsed"
+    return line
+
+
+def read_pages(path):
+    """(product, url) pairs from a CSV with `product` and `url` columns."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return [(row["product"].strip(), row["url"].strip()) for row in csv.DictReader(f) if row.get("url")]
+
+
+def enqueue_command(args):
+    from batch_ads import read_products
+
+    queue = WorkQueue(args.queue)
+    if args.retry_failed:
+        print(f"🔁 Re-queued {queue.retry_failed()} failed task(s).")
+    if args.products:
+        added = queue.add_products(dict.fromkeys(read_products(args.products)))
+        print(f"📥 Queued {added} new product search(es).")
+    if args.urls:
+        added = queue.add_pages(read_pages(args.urls))
+        print(f"📥 Queued {added} new page(s).")
+    print(format_progress(queue))
+
+
+def work_command(args):
+    if VECTOR_BACKEND == "memory":
+        sys.exit(f"❌ {MEMORY_BACKEND_ERROR}")
+    processes = args.processes
+    if VECTOR_BACKEND == "local" and processes > 1:
+        print("⚠️ VECTOR_BACKEND=local is a per-process index file; running a single worker process.")
+        processes = 1
+    log_dir = os.path.join(os.path.dirname(os.path.abspath(args.queue)), "worker-logs")
+    os.makedirs(log_dir, exist_ok=True)
+    threads = max(1, (os.cpu_count() or 1) // processes)
+
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=run_worker,
+            args=(args.queue, args.shard_size, args.lease_seconds, args.urls_per_product, args.fetch_workers, threads,
+                  os.path.join(log_dir, f"{socket.gethostname()}-{i}.log")),
+            name=f"ingest-worker-{i}",
+        )
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    print(f"🚀 Started {processes} worker process(es); logs in {log_dir}")
+
+    queue = WorkQueue(args.queue)
+    started = time.time()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=args.progress_interval / len(workers))
+            print(format_progress(queue, started))
+    except KeyboardInterrupt:
+        print("\n⏹️ Stopping workers; their leased tasks will be picked up again on the next run.")
+        for worker in workers:
+            worker.terminate()
+    for worker in workers:
+        worker.join()
+    print(format_progress(queue, started))
+
+
+def status_command(args):
+    queue = WorkQueue(args.queue)
+    print(format_progress(queue))
+    for kind, statuses in sorted(queue.counts().items()):
+        print(f"   {kind:<7} " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queue", default=INGEST_QUEUE_PATH, help="Work queue database (shared by all workers)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="Add products and/or pages to the queue")
+    enqueue.add_argument("products", nargs="?", help="CSV/JSONL/text file of product names to search for")
+    enqueue.add_argument("--urls", help="CSV with product,url columns for pages that are already known")
+    enqueue.add_argument("--retry-failed", action="store_true", help="Re-queue tasks that used up their attempts")
+    enqueue.set_defaults(func=enqueue_command)
+
+    work = commands.add_parser("work", help="Run worker processes until the queue is drained")
+    work.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    work.add_argument("--shard-size", type=int, default=INGEST_SHARD_SIZE)
+    work.add_argument("--lease-seconds", type=float, default=INGEST_LEASE_SECONDS)
+    work.add_argument("--urls-per-product", type=int, default=INGEST_URLS_PER_PRODUCT)
+    work.add_argument("--fetch-workers", type=int, default=8, help="Concurrent page fetches per worker process")
+    work.add_argument("--progress-interval", type=float, default=30.0)
+    work.set_defaults(func=work_command)
+
+    status = commands.add_parser("status", help="Show queue progress")
+    status.set_defaults(func=status_command)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
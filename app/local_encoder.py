@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+# Default batch sizes per device: GPUs amortise far larger batches than CPUs
+DEVICE_BATCH_SIZES = {"cuda": 128, "mps": 64, "cpu": 32}
+
+
+def detect_device():
+    """Best available torch device name ("cuda", "mps" or "cpu")."""
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def default_batch_size(device):
+    return DEVICE_BATCH_SIZES.get(device.split(":")[0], DEVICE_BATCH_SIZES["cpu"])
+
+
+def encode_sorted(model, texts, batch_size):
+    """
+    Encodes `texts` in length-sorted batches and returns a float32 matrix in input order.
+
+    Sorting groups similarly sized inputs so each batch pads to a similar length.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    encoded = model.encode(
+        [texts[i] for i in order],
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    result = np.empty_like(encoded, dtype=np.float32)
+    result[order] = encoded
+    return result
+
+
+# Worker-process state: each process loads the model once in its initializer
+_worker_model = None
+_worker_batch_size = None
+
+
+def _init_worker(model_name, device, batch_size, threads):
+    global _worker_model, _worker_batch_size
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device=device)
+    _worker_batch_size = batch_size
+
+
+def _encode_in_worker(texts):
+    return encode_sorted(_worker_model, texts, _worker_batch_size)
+
+
+class LocalEncoderPool:
+    """
+    Long-lived worker processes that each hold a preloaded sentence-transformers model.
+
+    Encoding runs outside the main interpreter, so the pipeline's threads keep
+    making progress while the CPU-bound inference happens. The pool defaults to
+    one worker per two cores with torch threads split between them.
+    """
+
+    def __init__(self, model_name, workers=None, device=None, batch_size=None):
+        cores = os.cpu_count() or 1
+        self.workers = workers or max(1, cores // 2)
+        self.device = device or detect_device()
+        self.batch_size = batch_size or default_batch_size(self.device)
+        threads = max(1, cores // self.workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),  # Never fork a process holding torch state
+            initializer=_init_worker,
+            initargs=(model_name, self.device, self.batch_size, threads),
+        )
+
+    def prewarm(self):
+        """Starts every worker and waits until each has loaded the model."""
+        for future in [self._executor.submit(_encode_in_worker, ["warmup"]) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, texts):
+        """
+        Encodes `texts` across the workers; returns a Future for the float32 matrix.
+
+        Inputs are length-sorted first and split into contiguous shards, one per
+        worker, so each shard still batches similarly sized texts.
+        """
+        texts = list(texts)
+        if not texts:
+            future = Future()
+            future.set_result(np.zeros((0, 0), dtype=np.float32))
+            return future
+
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        shard_size = max(self.batch_size, -(-len(texts) // self.workers))
+        shards = [order[i:i + shard_size] for i in range(0, len(order), shard_size)]
+        parts = [self._executor.submit(_encode_in_worker, [texts[i] for i in shard]) for shard in shards]
+
+        combined = Future()
+        remaining = [len(parts)]
+        lock = threading.Lock()
+
+        def collect(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                matrices = [part.result() for part in parts]
+            except Exception as e:
+                combined.set_exception(e)
+                return
+            result = np.empty((len(texts), matrices[0].shape[1]), dtype=np.float32)
+            for shard, matrix in zip(shards, matrices):
+                result[shard] = matrix
+            combined.set_result(result)
+
+        for part in parts:
+            part.add_done_callback(collect)
+        return combined
+
+    def encode(self, texts):
+        return self.submit(texts).result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,252 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+VECTORS_FILE = "vectors.npy"
+META_FILE = "meta.json"
+
+
+def matches_filter(metadata, filter):
+    """Evaluates a Pinecone-style metadata filter (`$eq`, `$ne`, `$in`, `$nin` or a bare value)."""
+    if not filter:
+        return True
+    for field, condition in filter.items():
+        value = metadata.get(field)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, expected in condition.items():
+            if op == "$eq" and value != expected:
+                return False
+            if op == "$ne" and value == expected:
+                return False
+            if op == "$in" and value not in expected:
+                return False
+            if op == "$nin" and value in expected:
+                return False
+    return True
+
+
+class LocalIndex:
+    """
+    Local vector index with the subset of the Pinecone `Index` interface used here.
+
+    Rows are kept L2-normalised in a float32 matrix so a query is one matrix-vector
+    product plus a top-k partition. With a `path` the matrix is persisted as a .npy
+    file and memory-mapped on load; it is saved whenever `persist_every` vector
+    writes are unsaved, and callers `persist()` at their own sync points.
+    Collections of at least `hnsw_threshold` vectors use an HNSW graph for
+    unfiltered queries when hnswlib is installed.
+    """
+
+    def __init__(self, path=None, hnsw_threshold=50000, persist_every=0):
+        self.path = path
+        self.hnsw_threshold = hnsw_threshold
+        self.persist_every = persist_every
+        self._unsaved = 0
+        self._ids = []
+        self._metadata = []
+        self._rows = {}
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._pending = []  # (row, normalised vector) waiting to be written into the matrix
+        self._postings = {}  # field -> {value: row indices}, built lazily for filtered fields
+        self._hnsw = None
+        self._dirty = False
+        self._lock = threading.RLock()
+        if path and os.path.exists(os.path.join(path, META_FILE)):
+            self._load()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _load(self):
+        with open(os.path.join(self.path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self._ids = meta["ids"]
+        self._metadata = meta["metadata"]
+        self._rows = {vector_id: row for row, vector_id in enumerate(self._ids)}
+        self._matrix = np.load(os.path.join(self.path, VECTORS_FILE), mmap_mode="r")
+
+    def persist(self):
+        """Writes the index to `path` atomically; no-op for in-memory indexes."""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._materialize()
+            os.makedirs(self.path, exist_ok=True)
+            vectors_tmp = os.path.join(self.path, VECTORS_FILE + ".tmp")
+            meta_tmp = os.path.join(self.path, META_FILE + ".tmp")
+            with open(vectors_tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(self._vectors()))
+            with open(meta_tmp, "w", encoding="utf-8") as f:
+                json.dump({"ids": self._ids, "metadata": self._metadata}, f)
+            os.replace(vectors_tmp, os.path.join(self.path, VECTORS_FILE))
+            os.replace(meta_tmp, os.path.join(self.path, META_FILE))
+            self._dirty = False
+            self._unsaved = 0
+
+    def _wrote(self, count):
+        self._dirty = True
+        self._unsaved += count
+        if self.persist_every and self._unsaved >= self.persist_every:
+            self.persist()
+
+    @staticmethod
+    def _normalise(values):
+        vector = np.asarray(values, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def upsert(self, vectors, namespace=None, **kwargs):
+        with self._lock:
+            for vector in vectors:
+                vector_id = vector["id"]
+                row = self._rows.get(vector_id)
+                if row is None:
+                    row = len(self._ids)
+                    self._rows[vector_id] = row
+                    self._ids.append(vector_id)
+                    self._metadata.append(dict(vector.get("metadata") or {}))
+                else:
+                    self._metadata[row] = dict(vector.get("metadata") or {})
+                self._pending.append((row, self._normalise(vector["values"])))
+            self._postings.clear()
+            self._hnsw = None
+            self._wrote(len(vectors))
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids=None, namespace=None, **kwargs):
+        with self._lock:
+            doomed = {self._rows[i] for i in (ids or []) if i in self._rows}
+            if not doomed:
+                return {}
+            self._materialize()
+            keep = [row for row in range(len(self._ids)) if row not in doomed]
+            self._matrix = np.array(self._vectors()[keep], dtype=np.float32)
+            self._ids = [self._ids[row] for row in keep]
+            self._metadata = [self._metadata[row] for row in keep]
+            self._rows = {vector_id: row for row, vector_id in enumerate(self._ids)}
+            self._postings.clear()
+            self._hnsw = None
+            self._wrote(len(doomed))
+        return {}
+
+    def _materialize(self):
+        """Applies pending upserts, growing (or copying out of the memory map) only when needed."""
+        if not self._pending:
+            return
+        count = len(self._ids)
+        dimension = self._matrix.shape[1] if self._matrix.size else len(self._pending[0][1])
+        matrix = self._matrix
+        if isinstance(matrix, np.memmap) or matrix.shape[0] < count or matrix.shape[1] != dimension:
+            capacity = max(count, 2 * len(matrix), 64)
+            grown = np.zeros((capacity, dimension), dtype=np.float32)
+            existing = min(len(matrix), count)
+            if existing and matrix.shape[1] == dimension:
+                grown[:existing] = matrix[:existing]
+            matrix = grown
+        for row, vector in self._pending:
+            matrix[row] = vector
+        self._matrix = matrix
+        self._pending = []
+
+    def _vectors(self):
+        """The populated rows of the matrix."""
+        return self._matrix[:len(self._ids)]
+
+    def _candidate_rows(self, filter):
+        """Row indices allowed by `filter`, using per-field postings for equality filters."""
+        rows = None
+        for field, condition in filter.items():
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            if set(condition) - {"$eq", "$in"}:
+                selected = np.array(
+                    [row for row, meta in enumerate(self._metadata) if matches_filter(meta, {field: condition})],
+                    dtype=np.int64,
+                )
+            else:
+                postings = self._postings.get(field)
+                if postings is None:
+                    grouped = {}
+                    for row, meta in enumerate(self._metadata):
+                        value = meta.get(field)
+                        try:
+                            grouped.setdefault(value, []).append(row)
+                        except TypeError:  # Unhashable metadata values can't be indexed
+                            continue
+                    postings = {value: np.array(r, dtype=np.int64) for value, r in grouped.items()}
+                    self._postings[field] = postings
+                values = [condition["$eq"]] if "$eq" in condition else list(condition["$in"])
+                parts = [postings[v] for v in values if v in postings]
+                selected = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+            rows = selected if rows is None else np.intersect1d(rows, selected)
+        return rows
+
+    def _build_hnsw(self):
+        vectors = np.asarray(self._vectors())
+        index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        index.init_index(max_elements=len(vectors), ef_construction=200, M=16)
+        index.add_items(vectors, np.arange(len(vectors)))
+        index.set_ef(64)
+        return index
+
+    def query(self, vector, top_k=10, include_metadata=False, filter=None, **kwargs):
+        with self._lock:
+            self._materialize()
+            if not self._ids:
+                return {"matches": []}
+            query = self._normalise(vector)
+
+            if not filter and hnswlib is not None and len(self._ids) >= self.hnsw_threshold:
+                if self._hnsw is None:
+                    self._hnsw = self._build_hnsw()
+                labels, distances = self._hnsw.knn_query(query, k=min(top_k, len(self._ids)))
+                rows = labels[0]
+                scores = 1.0 - distances[0]
+            else:
+                rows = self._candidate_rows(filter) if filter else None
+                matrix = self._vectors() if rows is None else self._matrix[rows]
+                if len(matrix) == 0:
+                    return {"matches": []}
+                all_scores = matrix @ query
+                k = min(top_k, len(all_scores))
+                top = np.argpartition(-all_scores, k - 1)[:k]
+                top = top[np.argsort(-all_scores[top])]
+                scores = all_scores[top]
+                rows = top if rows is None else rows[top]
+
+            matches = []
+            for row, score in zip(rows, scores):
+                match = {"id": self._ids[row], "score": float(score)}
+                if include_metadata:
+                    match["metadata"] = self._metadata[row]
+                matches.append(match)
+        return {"matches": matches}
+
+    def fetch(self, ids, **kwargs):
+        with self._lock:
+            self._materialize()
+            vectors = {}
+            for vector_id in ids:
+                row = self._rows.get(vector_id)
+                if row is not None:
+                    vectors[vector_id] = {
+                        "id": vector_id,
+                        "values": self._matrix[row].tolist(),
+                        "metadata": self._metadata[row],
+                    }
+        return {"vectors": vectors}
+
+    def describe_index_stats(self, **kwargs):
+        with self._lock:
+            dimension = self._matrix.shape[1] if self._matrix.size else (len(self._pending[0][1]) if self._pending else 0)
+            return {"total_vector_count": len(self._ids), "dimension": dimension}
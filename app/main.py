@@ -1,8 +1,46 @@
+import argparse
+
+import metrics
 from google_search import google_search
-from web_scraper import scrape_website
-from pinecone_db import store_in_pinecone, store_ad_in_pinecone
-from ad_generator import generate_ad
+from pipeline import run_scrape_pipeline
+from ad_generator import generate_ad_stream, wait_for_pending_stores, get_model, PRIMARY_MODEL
+from embedding import check_embedding_capabilities, get_local_encoder_pool, get_local_model
+from embedding_cache import get_embedding_cache
+from pinecone_db import get_index, get_ads_index
+
+
+def check_capabilities():
+    """Reports missing optional backends once at startup instead of failing mid-request."""
+    for warning in check_embedding_capabilities():
+        print(f"⚠️  {warning}")
 
+def prewarm():
+    """Loads models and opens clients ahead of time so the first request doesn't pay for it."""
+    print("🔥 Prewarming...")
+    get_embedding_cache()
+    get_index()
+    get_ads_index()
+    get_model(PRIMARY_MODEL)
+    pool = get_local_encoder_pool()
+    if pool is not None:
+        pool.prewarm()
+        print("✅ Local embedding workers ready.")
+    elif get_local_model() is not None:
+        print("✅ Local embedding model ready.")
+    print("✅ Clients ready.")
+
+def report_metrics(path=None):
+    """Prints where the run spent its time and writes the metrics file, when metrics are enabled."""
+    if not metrics.enabled():
+        return
+    print("\n⏱️ Time per stage:")
+    for stage in metrics.summary():
+        errors = f", {stage['errors']} failed" if stage["errors"] else ""
+        print(f"   {stage['stage']:<10} {stage['count']:>4}x  total {stage['total']:.2f}s  "
+              f"mean {stage['mean'] * 1000:.0f} ms  max {stage['max'] * 1000:.0f} ms{errors}")
+    written = metrics.export(path)
+    if written:
+        print(f"📊 Metrics written to {written}")
 
 def main():
     product_name = input("Enter product name: ")
@@ -16,33 +54,47 @@ def main():
     
     print(f"✅ Found {len(urls)} URLs. Proceeding to scrape data...\n")
     
-    scraped_data = []  # Store all scraped content for later use
-    
-    for index, url in enumerate(urls, start=1):
-        print(f"🕵️ Scraping ({index}/{len(urls)}): {url}")
-        content = scrape_website(url)
-        
-        if content:
-            print(f"✅ Successfully scraped content from {url}. Storing in Pinecone...\n")
-            metadata = {"url": url, "product": product_name, "content": content}
-            store_in_pinecone(content, metadata)
-            scraped_data.append(content)  # Collect for ad generation
-        else:
-            print(f"⚠️ Skipping {url} (No content extracted).")
+    # Fetch, chunk, embed and store all URLs concurrently, skipping pages unchanged since the last run
+    run = run_scrape_pipeline(urls, product_name)
+    scraped_data = run.contents
 
     print("\n🚀 Data processing complete! Ready to generate ads.\n")
     
-    # Generate ad only if we have scraped data
-    if scraped_data:
+    # Generate ad only if we have scraped data (new or already stored from a previous run)
+    if scraped_data or run.unchanged:
         print("\n📝 Generating Ad...")
-        ad_text = generate_ad(product_name)
-        
-        # Store the generated ad in Pinecone
-        store_ad_in_pinecone(product_name, ad_text)
-        
-        print("\n📢 Generated Ad:\n", ad_text)
+        # Print the ad as it streams in; it is stored in Pinecone once complete
+        for i, chunk in enumerate(generate_ad_stream(product_name)):
+            if i == 0:
+                print("\n📢 Generated Ad:\n")
+            print(chunk, end="", flush=True)
+        print()
+        wait_for_pending_stores()
     else:
         print("⚠️ No scraped data found. Skipping ad generation.")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="MarkPal: research a product and generate an ad.")
+    parser.add_argument("--batch", metavar="PRODUCTS_FILE", help="Generate ads for every product in a CSV/JSONL/text file")
+    parser.add_argument("--output", default="ads.jsonl", help="JSONL file for batch results (also the resume checkpoint)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent generation workers in batch mode")
+    parser.add_argument("--force-regenerate", action="store_true", help="Regenerate ads even if one is already stored")
+    parser.add_argument("--prewarm", action="store_true", help="Load models and open clients before starting")
+    parser.add_argument("--metrics", metavar="PATH", help="Record per-stage metrics and write them to PATH (*.prom for Prometheus text, otherwise JSON lines)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.metrics:
+        metrics.enable()
+    check_capabilities()
+    if args.prewarm:
+        prewarm()
+    try:
+        if args.batch:
+            from batch_ads import run_batch
+            run_batch(args.batch, args.output, workers=args.workers, force_regenerate=args.force_regenerate)
+        else:
+            main()
+    finally:
+        report_metrics(args.metrics)
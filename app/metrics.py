@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from config import METRICS_ENABLED, METRICS_PATH
+
+# Latency buckets in seconds, from a cache hit to a slow LLM call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MAX_SPANS = 10000  # Most recent spans kept for JSON lines export
+
+_enabled = METRICS_ENABLED
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_spans = deque(maxlen=MAX_SPANS)
+
+
+def enable(flag=True):
+    """Turns recording on or off at runtime (METRICS_ENABLED sets the default)."""
+    global _enabled
+    _enabled = flag
+
+
+def enabled():
+    return _enabled
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def incr(name, value=1, **labels):
+    """Adds `value` to the counter `name` (e.g. api_calls, fallbacks, retries, bytes_scraped)."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Records one sample of the histogram `name`."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **labels):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """Times one stage; the duration goes to the `stage_seconds` histogram and the span log."""
+
+    __slots__ = ("stage", "labels", "started", "wall_started")
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+
+    def set(self, **labels):
+        """Adds labels only known once the stage has run (e.g. which backend answered)."""
+        self.labels.update(labels)
+
+    def __enter__(self):
+        self.wall_started = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        status = "ok" if exc_type is None else "error"
+        observe("stage_seconds", duration, stage=self.stage, **self.labels)
+        incr("stage_calls", stage=self.stage, status=status, **self.labels)
+        record = {
+            "type": "span",
+            "stage": self.stage,
+            "start": round(self.wall_started, 6),
+            "duration": round(duration, 6),
+            "status": status,
+            "thread": threading.current_thread().name,
+        }
+        record.update(self.labels)
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        with _lock:
+            _spans.append(record)
+        return False
+
+
+def span(stage, **labels):
+    """
+    Context manager timing one pipeline stage, e.g. `with span("embed", backend="gemini"):`.
+
+    Returns a shared no-op object when metrics are disabled, so instrumented
+    code pays only for the flag check.
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(stage, labels)
+
+
+def spans():
+    """The recorded span records, oldest first."""
+    with _lock:
+        return list(_spans)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _spans.clear()
+
+
+def snapshot():
+    """Current counters and histograms as plain dicts."""
+    with _lock:
+        counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in _counters.items()]
+        histograms = [
+            {"name": name, "labels": dict(labels), "buckets": dict(zip(LATENCY_BUCKETS, h["buckets"])),
+             "sum": h["sum"], "count": h["count"]}
+            for (name, labels), h in _histograms.items()
+        ]
+    return {"counters": counters, "histograms": histograms}
+
+
+def to_jsonl():
+    """Spans, then counters and histograms, one JSON object per line."""
+    with _lock:
+        spans = list(_spans)
+    data = snapshot()
+    lines = [json.dumps(record, ensure_ascii=False) for record in spans]
+    lines += [json.dumps(dict(counter, type="counter")) for counter in data["counters"]]
+    lines += [json.dumps(dict(histogram, type="histogram")) for histogram in data["histograms"]]
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _prometheus_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def to_prometheus(prefix="markpal"):
+    """Counters and histograms in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = []
+    for name in sorted({c["name"] for c in data["counters"]}):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        for counter in (c for c in data["counters"] if c["name"] == name):
+            lines.append(f"{prefix}_{name}_total{_prometheus_labels(counter['labels'])} {counter['value']}")
+    for name in sorted({h["name"] for h in data["histograms"]}):
+        lines.append(f"# TYPE {prefix}_{name} histogram")
+        for histogram in (h for h in data["histograms"] if h["name"] == name):
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append(f"{prefix}_{name}_bucket{_prometheus_labels(histogram['labels'], {'le': bound})} {cumulative}")
+            labels = histogram["labels"]
+            lines.append(f"{prefix}_{name}_bucket{_prometheus_labels(labels, {'le': '+Inf'})} {histogram['count']}")
+            lines.append(f"{prefix}_{name}_sum{_prometheus_labels(labels)} {histogram['sum']}")
+            lines.append(f"{prefix}_{name}_count{_prometheus_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def export(path=None):
+    """
+    Writes the metrics to `path` (METRICS_PATH by default).
+
+    Files ending in `.prom` or `.txt` get the Prometheus text format; anything
+    else gets JSON lines. Returns the path written, or None when there is nothing to do.
+    """
+    path = path or METRICS_PATH
+    if not path or not _enabled:
+        return None
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    content = to_prometheus() if path.endswith((".prom", ".txt")) else to_jsonl()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
+
+
+def summary():
+    """Per-stage count, mean and max latency from the recorded spans, slowest total first."""
+    with _lock:
+        spans = list(_spans)
+    stages = {}
+    for record in spans:
+        stats = stages.setdefault(record["stage"], {"count": 0, "total": 0.0, "max": 0.0, "errors": 0})
+        stats["count"] += 1
+        stats["total"] += record["duration"]
+        stats["max"] = max(stats["max"], record["duration"])
+        stats["errors"] += record["status"] == "error"
+    return sorted(
+        ({"stage": stage, "mean": s["total"] / s["count"], **s} for stage, s in stages.items()),
+        key=lambda s: s["total"],
+        reverse=True,
+    )
+
@@ -1,37 +1,424 @@
+import atexit
+import math
+import os
+import threading
+import time
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, wait
+
 from config import (
     PINECONE_API_KEY, 
     PINECONE_INDEX_NAME, 
-    PINECONE_ADS_INDEX_NAME
+    PINECONE_ADS_INDEX_NAME,
+    VECTOR_BACKEND,
+    LOCAL_INDEX_DIR,
+    LOCAL_INDEX_PERSIST_EVERY,
+    AD_CACHE_TTL,
+    VECTOR_STORE_DEADLINE,
 )
-from embedding import get_embedding
-from pinecone import Pinecone
+import metrics
+from embedding import get_embedding, get_embeddings
+from resilience import call
+
+pc = None
+
+def open_index(name, backend=VECTOR_BACKEND):
+    """Opens the named index on the configured backend (Pinecone, local NumPy or in-memory)."""
+    global pc
+    if backend == "local":
+        from local_index import LocalIndex  # NumPy is only needed for the local backend
+        local = LocalIndex(os.path.join(LOCAL_INDEX_DIR, name), persist_every=LOCAL_INDEX_PERSIST_EVERY)
+        atexit.register(local.persist)  # Last resort; writers call persist_indexes() at their sync points
+        return local
+    if backend == "memory":
+        return InMemoryIndex()
+    if pc is None:
+        from pinecone import Pinecone
+        # Initialize Pinecone client
+        pc = Pinecone(api_key=PINECONE_API_KEY)
+    return pc.Index(name=name)
+
+def store_endpoint(name):
+    """Circuit breaker name for the index `name`; each index has its own host, so its own breaker."""
+    return f"vector_store:{name}"
+
+class InMemoryIndex:
+    """
+    In-process stand-in for a Pinecone `Index`.
+
+    Mimics `upsert`, `query`, `fetch` and `describe_index_stats` with brute-force
+    cosine similarity so writers and queries can be exercised offline.
+    """
+
+    def __init__(self, upsert_delay=0.0):
+        self.upsert_delay = upsert_delay  # Simulated network latency per upsert call
+        self.upsert_calls = 0
+        self._vectors = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors, namespace=None, **kwargs):
+        if self.upsert_delay:
+            time.sleep(self.upsert_delay)
+        with self._lock:
+            self.upsert_calls += 1
+            for vector in vectors:
+                self._vectors[vector["id"]] = {
+                    "id": vector["id"],
+                    "values": list(vector["values"]),
+                    "metadata": dict(vector.get("metadata") or {}),
+                }
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector, top_k=10, include_metadata=False, filter=None, **kwargs):
+        from local_index import matches_filter
+        query_norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        with self._lock:
+            stored = list(self._vectors.values())
+        scored = []
+        for item in stored:
+            if not matches_filter(item["metadata"], filter):
+                continue
+            values = item["values"]
+            norm = math.sqrt(sum(v * v for v in values)) or 1.0
+            score = sum(a * b for a, b in zip(vector, values)) / (query_norm * norm)
+            scored.append((score, item))
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        matches = []
+        for score, item in scored[:top_k]:
+            match = {"id": item["id"], "score": score}
+            if include_metadata:
+                match["metadata"] = item["metadata"]
+            matches.append(match)
+        return {"matches": matches}
+
+    def delete(self, ids=None, namespace=None, **kwargs):
+        with self._lock:
+            for vector_id in ids or []:
+                self._vectors.pop(vector_id, None)
+        return {}
+
+    def fetch(self, ids, **kwargs):
+        with self._lock:
+            return {"vectors": {i: self._vectors[i] for i in ids if i in self._vectors}}
+
+    def describe_index_stats(self, **kwargs):
+        with self._lock:
+            return {"total_vector_count": len(self._vectors)}
+
+
+class PineconeWriter:
+    """
+    Buffered bulk writer for a Pinecone index.
+
+    Vectors are collected and flushed in batches of `batch_size`, or after
+    `flush_interval` seconds for a partial batch. Batches are upserted in
+    parallel on `max_workers` threads and retried up to `max_retries` times
+    through the `endpoint` circuit breaker (the scraped-data index's by
+    default); per-batch latency is recorded in `batch_latencies`.
+    """
+
+    def __init__(self, index, batch_size=100, flush_interval=1.0, max_workers=4, max_retries=3, verbose=True,
+                 endpoint=store_endpoint(PINECONE_INDEX_NAME)):
+        self.index = index
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.verbose = verbose
+        self.batch_latencies = []
+        self.upserted = 0
+        self.failed = 0
+        self._buffer = []
+        self._buffer_started = None
+        self._pending = set()
+        self._lock = threading.RLock()  # Done-callbacks may fire inside _submit while it is held
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pinecone-writer")
+        self._closed = threading.Event()
+        self._timer = threading.Thread(target=self._flush_periodically, name="pinecone-writer-timer", daemon=True)
+        self._timer.start()
+
+    def add(self, vector_id, values, metadata=None):
+        """Buffers one vector; a full buffer is flushed immediately."""
+        self.add_many([{"id": vector_id, "values": values, "metadata": metadata or {}}])
+
+    def add_many(self, vectors):
+        """Buffers several vectors in Pinecone's `{"id", "values", "metadata"}` form."""
+        with self._lock:
+            if self._closed.is_set():
+                raise RuntimeError("PineconeWriter is closed")
+            if not self._buffer:
+                self._buffer_started = time.monotonic()
+            self._buffer.extend(vectors)
+            while len(self._buffer) >= self.batch_size:
+                batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+                self._submit(batch)
+            if not self._buffer:
+                self._buffer_started = None
+
+    def flush(self, wait_for_completion=True):
+        """Sends any buffered vectors and optionally waits for in-flight batches."""
+        with self._lock:
+            if self._buffer:
+                self._submit(self._buffer)
+                self._buffer = []
+                self._buffer_started = None
+            pending = list(self._pending)
+        if wait_for_completion and pending:
+            wait(pending)
+
+    def close(self):
+        """Flushes everything and stops the writer's threads."""
+        self.flush()
+        self._closed.set()
+        self._timer.join()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _submit(self, batch):
+        future = self._executor.submit(self._upsert_batch, batch)
+        self._pending.add(future)
+        future.add_done_callback(self._finished)
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending.discard(future)
 
-# Initialize Pinecone client
-pc = Pinecone(api_key=PINECONE_API_KEY)
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval / 2):
+            with self._lock:
+                expired = (
+                    self._buffer_started is not None
+                    and time.monotonic() - self._buffer_started >= self.flush_interval
+                )
+            if expired:
+                self.flush(wait_for_completion=False)
 
-# Initialize indexes
-index = pc.Index(name=PINECONE_INDEX_NAME)
-ads_index = pc.Index(name=PINECONE_ADS_INDEX_NAME)
+    def _upsert_once(self, batch):
+        with metrics.span("upsert", mode="bulk"):
+            self.index.upsert(vectors=batch)
+
+    def _upsert_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            call(self.endpoint, self._upsert_once, batch, retries=self.max_retries, deadline=VECTOR_STORE_DEADLINE)
+        except Exception as e:
+            print(f"❌ Upsert of {len(batch)} vectors failed: {e}")
+            with self._lock:
+                self.failed += len(batch)
+            metrics.incr("vectors_failed", len(batch))
+            return
+        latency = time.perf_counter() - started
+        with self._lock:
+            self.batch_latencies.append(latency)
+            self.upserted += len(batch)
+        metrics.incr("vectors_upserted", len(batch))
+        if self.verbose:
+            print(f"📤 Upserted {len(batch)} vectors in {latency * 1000:.0f} ms")
+
+    def stats(self):
+        """Throughput counters and batch latency summary."""
+        with self._lock:
+            latencies = sorted(self.batch_latencies)
+            stats = {"upserted": self.upserted, "failed": self.failed, "batches": len(latencies)}
+        if latencies:
+            stats["p50_batch_latency"] = latencies[len(latencies) // 2]
+            stats["max_batch_latency"] = latencies[-1]
+        return stats
+
+class TTLCache:
+    """Small thread-safe in-process cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                # Drop the entry closest to expiry to make room
+                del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_MISSING = object()
+_ad_cache = TTLCache(AD_CACHE_TTL)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def _get_named_index(name):
+    with _indexes_lock:
+        if name not in _indexes:
+            _indexes[name] = open_index(name)
+        return _indexes[name]
+
+def get_index():
+    """Index of scraped review pages, opened on first use."""
+    return _get_named_index(PINECONE_INDEX_NAME)
+
+def get_ads_index():
+    """Index of generated ads, opened on first use."""
+    return _get_named_index(PINECONE_ADS_INDEX_NAME)
+
+def persist_indexes():
+    """
+    Saves opened local indexes to disk (a no-op for Pinecone and in-memory indexes).
+
+    Call before recording anything as stored, so a crash cannot leave ingestion
+    state pointing at vectors that only ever existed in memory.
+    """
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        persist = getattr(index, "persist", None)
+        if persist is not None:
+            persist()
+
+def vector_count(index):
+    """Total vectors in `index`, from a Pinecone stats response or a plain dict."""
+    stats = index.describe_index_stats()
+    if isinstance(stats, dict):
+        return stats.get("total_vector_count", 0)
+    return getattr(stats, "total_vector_count", 0)
+
+def as_values(embedding):
+    """Plain float list for the Pinecone API (local embeddings are float32 arrays)."""
+    return embedding.tolist() if hasattr(embedding, "tolist") else embedding
 
 def store_in_pinecone(text, metadata):
     """Stores text embeddings in Pinecone."""
     embedding = get_embedding(text)
-    index.upsert(vectors=[{"id": metadata["url"], "values": embedding, "metadata": metadata}])
+    vectors = [{"id": metadata["url"], "values": as_values(embedding), "metadata": metadata}]
+    with metrics.span("upsert", mode="single"):
+        call(store_endpoint(PINECONE_INDEX_NAME), get_index().upsert, vectors=vectors, deadline=VECTOR_STORE_DEADLINE)
+    metrics.incr("vectors_upserted")
+
+def store_many_in_pinecone(texts, metadatas, writer=None, ids=None):
+    """
+    Embeds several texts in one batch and stores them.
+
+    Vector IDs default to each metadata's `url`. With a `PineconeWriter` the
+    vectors are queued for bulk upsert and this returns as soon as embedding is
+    done; otherwise they go out in one upsert.
+    """
+    embeddings = get_embeddings(texts)
+    ids = ids or [metadata["url"] for metadata in metadatas]
+    vectors = [
+        {"id": vector_id, "values": as_values(embedding), "metadata": metadata}
+        for vector_id, embedding, metadata in zip(ids, embeddings, metadatas)
+        if embedding is not None
+    ]
+    if vectors:
+        if writer is not None:
+            writer.add_many(vectors)
+        else:
+            with metrics.span("upsert", mode="batch"):
+                call(store_endpoint(PINECONE_INDEX_NAME), get_index().upsert, vectors=vectors, deadline=VECTOR_STORE_DEADLINE)
+            metrics.incr("vectors_upserted", len(vectors))
+    return len(vectors)
 
-def query_pinecone(query, top_k=3):
-    """Queries Pinecone to retrieve the most relevant stored embeddings."""
-    query_embedding = get_embedding(query)
-    results = index.query(vector=query_embedding, top_k=top_k, include_metadata=True)
+def delete_from_pinecone(ids):
+    """Removes vectors (e.g. chunks that disappeared from a page) from the scraped-data index."""
+    if ids:
+        call(store_endpoint(PINECONE_INDEX_NAME), get_index().delete, ids=list(ids), deadline=VECTOR_STORE_DEADLINE)
+
+def query_pinecone(query, top_k=3, product=None):
+    """Queries Pinecone to retrieve the most relevant stored embeddings, optionally for one product only."""
+    with metrics.span("retrieval"):
+        query_embedding = as_values(get_embedding(query))
+        query_filter = {"product": {"$eq": product}} if product else None
+        results = call(
+            store_endpoint(PINECONE_INDEX_NAME),
+            get_index().query,
+            vector=query_embedding,
+            top_k=top_k,
+            include_metadata=True,
+            filter=query_filter,
+            deadline=VECTOR_STORE_DEADLINE,
+        )
     return [res["metadata"]["content"] for res in results.get("matches", [])]
 
+def ad_key(product):
+    """Normalised, ASCII-safe vector ID for a product's ad (case and whitespace insensitive)."""
+    return quote(" ".join(product.lower().split()), safe=" ")
+
+def _fetched_metadata(response):
+    """Metadata of fetched vectors from either a Pinecone FetchResponse or a plain dict."""
+    vectors = response.get("vectors", {}) if isinstance(response, dict) else getattr(response, "vectors", {})
+    fetched = {}
+    for vector_id, vector in (vectors or {}).items():
+        metadata = vector.get("metadata") if isinstance(vector, dict) else getattr(vector, "metadata", None)
+        fetched[vector_id] = metadata or {}
+    return fetched
+
 def store_ad_in_pinecone(product, ad_text):
     """Stores generated ad content in a separate Pinecone index."""
     embedding = get_embedding(ad_text)
     metadata = {"product": product, "ad_text": ad_text}
-    ads_index.upsert(vectors=[{"id": product, "values": embedding, "metadata": metadata}])
+    key = ad_key(product)
+    vectors = [{"id": key, "values": as_values(embedding), "metadata": metadata}]
+    with metrics.span("upsert", mode="ad"):
+        call(store_endpoint(PINECONE_ADS_INDEX_NAME), get_ads_index().upsert, vectors=vectors, deadline=VECTOR_STORE_DEADLINE)
+    persist_indexes()
+    _ad_cache.set(key, ad_text)
+
+def fetch_ad(product):
+    """
+    Looks up the stored ad for a product by its exact normalised key.
+
+    Uses an in-process TTL cache, then a direct fetch-by-id; no embedding call or
+    similarity search is made. Returns None when no ad is stored under the key.
+    """
+    key = ad_key(product)
+    cached = _ad_cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        metrics.incr("cache_hits", cache="ad")
+        return cached
+
+    # Ads stored before keys were normalised used the raw product name as the ID
+    ids = [key] if product == key else [key, product]
+    with metrics.span("ad_lookup", method="fetch"):
+        response = call(store_endpoint(PINECONE_ADS_INDEX_NAME), get_ads_index().fetch, ids=ids, deadline=VECTOR_STORE_DEADLINE)
+        fetched = _fetched_metadata(response)
+    ad_text = None
+    for vector_id in ids:
+        if vector_id in fetched and fetched[vector_id].get("ad_text"):
+            ad_text = fetched[vector_id]["ad_text"]
+            break
+    _ad_cache.set(key, ad_text)
+    return ad_text
 
 def query_ad_pinecone(product, top_k=1):
     """Retrieves stored ads for a product from Pinecone."""
-    query_embedding = get_embedding(product)
-    results = ads_index.query(vector=query_embedding, top_k=top_k, include_metadata=True)
+    with metrics.span("ad_lookup", method="query"):
+        query_embedding = as_values(get_embedding(product))
+        results = call(
+            store_endpoint(PINECONE_ADS_INDEX_NAME),
+            get_ads_index().query,
+            vector=query_embedding,
+            top_k=top_k,
+            include_metadata=True,
+            deadline=VECTOR_STORE_DEADLINE,
+        )
     return [res["metadata"]["ad_text"] for res in results.get("matches", [])]
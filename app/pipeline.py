@@ -0,0 +1,285 @@
+import queue
+import threading
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from ingest import INGEST_MAX_CHARS, IngestState, plan_page
+from pinecone_db import (
+    PineconeWriter,
+    delete_from_pinecone,
+    get_index,
+    persist_indexes,
+    store_many_in_pinecone,
+    vector_count,
+)
+from web_scraper import fetch_text, get_session
+
+FETCH_WORKERS = 8
+PER_HOST_LIMIT = 2
+QUEUE_SIZE = 16
+STORE_BATCH_SIZE = 16
+
+_DONE = object()
+
+# contents: page texts in URL order; unchanged: pages skipped because nothing changed since the last run;
+# failed: URLs that could not be fetched or stored (their ingestion state is left for the next run)
+ScrapeRun = namedtuple("ScrapeRun", ["contents", "unchanged", "failed"], defaults=((),))
+_print_lock = threading.Lock()
+
+
+def _log(message):
+    """Prints progress lines from concurrent stages without interleaving."""
+    with _print_lock:
+        print(message)
+
+
+class HostScheduler:
+    """
+    Submits fetches to a thread pool with at most `per_host` in flight per host.
+
+    URLs beyond a host's limit wait in a per-host queue and are only submitted
+    when one of that host's fetches finishes, so a slow site never holds pool
+    workers that other hosts could use.
+    """
+
+    def __init__(self, pool, fetch, per_host):
+        self.pool = pool
+        self.fetch = fetch
+        self.per_host = per_host
+        self._waiting = defaultdict(deque)
+        self._active = defaultdict(int)
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def submit(self, index, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            self._outstanding += 1
+            if self._active[host] >= self.per_host:
+                self._waiting[host].append((index, url))
+                return
+            self._active[host] += 1
+        self._start(host, index, url)
+
+    def _start(self, host, index, url):
+        future = self.pool.submit(self.fetch, index, url)
+        future.add_done_callback(lambda _: self._finished(host))
+
+    def _finished(self, host):
+        with self._lock:
+            self._outstanding -= 1
+            following = self._waiting[host].popleft() if self._waiting[host] else None
+            if following is None:
+                self._active[host] -= 1
+            if not self._outstanding:
+                self._idle.notify_all()
+        if following is not None:
+            self._start(host, *following)
+
+    def wait(self):
+        """Blocks until every submitted URL has been fetched."""
+        with self._lock:
+            while self._outstanding:
+                self._idle.wait()
+
+
+def _drain(source, first, limit):
+    """Collects `first` plus whatever else is already queued, up to `limit` items."""
+    items = [first]
+    while len(items) < limit:
+        try:
+            item = source.get_nowait()
+        except queue.Empty:
+            break
+        if item is _DONE:
+            source.put(_DONE)
+            break
+        items.append(item)
+    return items
+
+
+def run_scrape_pipeline(
+    urls,
+    product_name,
+    fetch_workers=FETCH_WORKERS,
+    per_host_limit=PER_HOST_LIMIT,
+    queue_size=QUEUE_SIZE,
+    store_batch_size=STORE_BATCH_SIZE,
+    state=None,
+):
+    """
+    Scrapes, chunks, embeds and stores `urls` concurrently and incrementally.
+
+    Fetches run on a bounded thread pool over a pooled session, streaming each
+    page through the incremental extractor so the download stops once the
+    character budget is met. URLs are scheduled per host: a saturated host's
+    URLs wait in their own queue instead of holding workers. Reporting and
+    embedding+upsert are downstream stages fed through bounded queues, so a
+    slow site only holds up its own fetches.
+
+    Pages are split into overlapping chunks with stable IDs. Conditional
+    requests (ETag/Last-Modified) and content hashes recorded in `state`
+    skip pages and chunks that have not changed since the last run, and
+    chunks that vanished from a page are deleted.
+
+    Returns a ScrapeRun with the scraped contents in the order of `urls`.
+    """
+    total = len(urls)
+    state = state or IngestState()
+    try:
+        index_emptied = not state.is_empty() and vector_count(get_index()) == 0
+    except Exception as e:
+        _log(f"⚠️ Warning: could not check the vector index size: {e}")
+        index_emptied = False
+    if index_emptied:
+        # The index was deleted or recreated since the last run; nothing recorded is there any more
+        _log("⚠️ The vector index is empty; forgetting the recorded ingestion state.")
+        state.clear()
+    session = get_session(pool_size=max(fetch_workers, 10))
+    extracted_queue = queue.Queue(maxsize=queue_size)
+    store_queue = queue.Queue(maxsize=queue_size)
+    results = {}
+    unchanged = []
+    completed_pages = []  # State updates applied once their upserts have succeeded
+    failed_urls = []
+    store_errors = [0]
+    # Upserts run in the background so embedding the next batch is not blocked on the network
+    writer = PineconeWriter(get_index(), verbose=False)
+
+    def fetch(index, url):
+        result = None
+        try:
+            previous = state.get(url, product_name)
+            _log(f"🕵️ Scraping ({index}/{total}): {url}")
+            result = fetch_text(
+                url,
+                session=session,
+                max_chars=INGEST_MAX_CHARS,
+                etag=previous and previous["etag"],
+                last_modified=previous and previous["last_modified"],
+            )
+        except Exception as e:
+            _log(f"Failed to scrape {url}: {e}")
+            failed_urls.append(url)
+        finally:
+            # Always hand the URL on, so the downstream stages see every page exactly once
+            extracted_queue.put((index, url, result))
+
+    def report_stage():
+        while True:
+            item = extracted_queue.get()
+            if item is _DONE:
+                store_queue.put(_DONE)
+                return
+            index, url, result = item
+            if result is None:
+                continue
+            try:
+                if result.not_modified:
+                    _log(f"♻️ {url} not modified since the last run; skipping.")
+                    state.touch_validators(url, product_name, result.etag, result.last_modified)
+                    unchanged.append(url)
+                    continue
+                page_size = f" of {result.content_length}" if result.content_length else ""
+                _log(f"📦 {url}: downloaded {result.bytes_downloaded}{page_size} bytes, used {result.bytes_used}")
+                if not result.text:
+                    _log(f"⚠️ Skipping {url} (No content extracted).")
+                    continue
+            except Exception as e:
+                _log(f"⚠️ Warning: failed to process {url}: {e}")
+                failed_urls.append(url)
+                continue
+            store_queue.put((index, url, result))
+
+    def plan_batch(batch):
+        """Plans each page of `batch`; returns the ids, texts and metadatas of the new chunks."""
+        ids, texts, metadatas = [], [], []
+        for index, url, result in batch:
+            try:
+                previous = state.get(url, product_name)
+                page_hash, chunks, new_chunks, stale_ids = plan_page(product_name, url, result.text, previous)
+                results[index] = result.text
+                if not new_chunks and not stale_ids:
+                    _log(f"♻️ {url} content unchanged; nothing to re-embed.")
+                    state.touch_validators(url, product_name, result.etag, result.last_modified)
+                    unchanged.append(url)
+                    continue
+            except Exception as e:
+                _log(f"⚠️ Warning: failed to prepare {url} for storing: {e}")
+                failed_urls.append(url)
+                continue
+            _log(f"✅ Successfully scraped content from {url}. Storing {len(new_chunks)} new chunk(s) in Pinecone...\n")
+            for vector_id, chunk in new_chunks:
+                ids.append(vector_id)
+                texts.append(chunk)
+                metadatas.append({"url": url, "product": product_name, "content": chunk})
+            completed_pages.append(
+                (url, result.etag, result.last_modified, page_hash, [cid for cid, _ in chunks], stale_ids)
+            )
+        return ids, texts, metadatas
+
+    def store_stage():
+        while True:
+            item = store_queue.get()
+            if item is _DONE:
+                return
+            batch = _drain(store_queue, item, store_batch_size)
+            ids, texts, metadatas = plan_batch(batch)
+            if not texts:
+                continue
+            try:
+                store_many_in_pinecone(texts, metadatas, writer=writer, ids=ids)
+            except Exception as e:
+                _log(f"⚠️ Warning: failed to store {len(texts)} chunk(s) in Pinecone: {e}")
+                store_errors[0] += len(texts)
+
+    stages = [
+        threading.Thread(target=report_stage, name="scrape-report", daemon=True),
+        threading.Thread(target=store_stage, name="scrape-store", daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+
+    with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="scrape-fetch") as pool:
+        scheduler = HostScheduler(pool, fetch, per_host_limit)
+        for index, url in enumerate(urls, start=1):
+            scheduler.submit(index, url)
+        scheduler.wait()  # Queued URLs are submitted from completion callbacks, so wait before shutdown
+    extracted_queue.put(_DONE)
+
+    for stage in stages:
+        stage.join()
+    writer.close()
+
+    failed = writer.failed + store_errors[0]
+    if failed:
+        # Leave the state untouched so the next run retries these pages
+        _log(f"⚠️ {failed} chunk(s) failed to store; ingestion state not updated for this run.")
+        failed_urls.extend(url for url, *_ in completed_pages)
+        return ScrapeRun([results[index] for index in sorted(results)], len(unchanged), failed_urls)
+
+    stored_pages = []
+    for page in completed_pages:
+        try:
+            delete_from_pinecone(page[-1])
+            stored_pages.append(page)
+        except Exception as e:
+            _log(f"⚠️ Warning: failed to delete stale chunks for {page[0]}: {e}")
+            failed_urls.append(page[0])
+    try:
+        # Vectors must be on disk before the state says these pages are stored
+        persist_indexes()
+    except Exception as e:
+        _log(f"⚠️ Warning: failed to save the vector index: {e}; ingestion state not updated for this run.")
+        failed_urls.extend(url for url, *_ in stored_pages)
+        stored_pages = []
+    for url, etag, last_modified, page_hash, chunk_ids, _ in stored_pages:
+        try:
+            state.put(url, product_name, etag, last_modified, page_hash, chunk_ids)
+        except Exception as e:
+            _log(f"⚠️ Warning: failed to record {url} as stored: {e}")
+            failed_urls.append(url)
+
+    return ScrapeRun([results[index] for index in sorted(results)], len(unchanged), failed_urls)
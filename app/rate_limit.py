@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token-bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`, so short
+    bursts go through immediately while the sustained rate stays bounded.
+    A non-positive rate disables limiting.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute, burst=None):
+        """Builds a bucket from a requests-per-minute quota."""
+        return cls(float(requests_per_minute) / 60.0, burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self, tokens=1):
+        """Takes `tokens` if available right now; returns False instead of waiting."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available, then takes them."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedTokenBucket:
+    """
+    Token bucket whose state lives in a SQLite file, so every process (or
+    machine on a shared volume) using the same `path` and `name` draws from
+    one quota. Same `try_acquire`/`acquire` interface as TokenBucket.
+    """
+
+    def __init__(self, path, name, rate, capacity=None):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    @classmethod
+    def per_minute(cls, path, name, requests_per_minute, burst=None):
+        return cls(path, name, float(requests_per_minute) / 60.0, burst)
+
+    def _take(self, tokens):
+        """Takes `tokens` if available; otherwise returns the seconds to wait."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()  # Wall clock: the state is shared between processes
+                row = self._conn.execute("SELECT tokens, updated FROM rate_limits WHERE name = ?", (self.name,)).fetchone()
+                available = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+                wait = 0.0
+                if available >= tokens:
+                    available -= tokens
+                else:
+                    wait = (tokens - available) / self.rate
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (name, tokens, updated) VALUES (?, ?, ?)",
+                    (self.name, available, now),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def try_acquire(self, tokens=1):
+        if self.rate <= 0:
+            return True
+        return self._take(tokens) == 0.0
+
+    def acquire(self, tokens=1):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take(tokens)
+            if wait == 0.0:
+                return
+            time.sleep(wait)
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS, MODEL_DEMOTION_TTL, MODEL_PREFERENCE_PATH
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+
+def status_code(error):
+    """HTTP-style status of an error from requests or the Google SDKs, if it has one."""
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "status_code", None):
+        return response.status_code
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    return None
+
+
+def is_transient(error):
+    """
+    Whether retrying `error` can help: timeouts, connection errors, 408/429 and 5xx.
+
+    Other 4xx answers (bad key, unknown model, bad request) fail fast. Errors
+    with no status are treated as transient.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    status = status_code(error)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    return True
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls are rejected immediately for `reset_timeout` seconds. Then a single
+    trial call is let through (half-open): success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """True if a call may go ahead now."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            was_open = self.opened_at is not None
+            if was_open or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if not was_open:
+                    print(f"⚡ Circuit for {self.name} opened after {self.failures} consecutive failures.")
+                    metrics.incr("circuit_opened", endpoint=self.name)
+            self._trial_running = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """The shared circuit breaker for endpoint `name`."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def is_available(name):
+    """True unless the circuit for `name` is open (does not use up a half-open trial)."""
+    return get_breaker(name).state != "open"
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Full-jitter exponential backoff: uniform in [0, min(max_delay, base_delay * 2**attempt)]."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedged-request")
+
+
+def hedged(func, args=(), kwargs=None, hedge_after=None, timeout=None):
+    """
+    Runs `func` and, if it has not answered within `hedge_after` seconds,
+    starts a second identical request; the first successful result wins.
+
+    The slower request is left to finish in the background and its result is
+    discarded, so only hedge idempotent calls.
+    """
+    kwargs = kwargs or {}
+    first = _hedge_pool.submit(func, *args, **kwargs)
+    done, _ = wait([first], timeout=hedge_after)
+    if done:
+        return first.result()
+
+    metrics.incr("hedged_requests", endpoint=getattr(func, "__name__", "call"))
+    pending = {first, _hedge_pool.submit(func, *args, **kwargs)}
+    error = None
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while pending:
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            raise TimeoutError(f"hedged call did not finish within {timeout}s")
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def call(
+    name,
+    func,
+    *args,
+    retries=2,
+    deadline=None,
+    base_delay=0.5,
+    max_delay=8.0,
+    retryable=is_transient,
+    hedge_after=None,
+    **kwargs
+):
+    """
+    Calls `func(*args, **kwargs)` through the circuit breaker for endpoint `name`.
+
+    Transient failures are retried up to `retries` times with full-jitter
+    backoff. No retry is started that could not finish before `deadline`
+    (seconds from now). With `hedge_after`, each attempt is a hedged request.
+    Raises CircuitOpenError without calling when the circuit is open, otherwise
+    the last error.
+    """
+    breaker = get_breaker(name)
+    expires = None if deadline is None else time.monotonic() + deadline
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            metrics.incr("circuit_rejected", endpoint=name)
+            raise CircuitOpenError(f"{name} is unavailable (circuit open)")
+        try:
+            if hedge_after:
+                remaining = None if expires is None else max(0.0, expires - time.monotonic())
+                result = hedged(func, args, kwargs, hedge_after=hedge_after, timeout=remaining)
+            else:
+                result = func(*args, **kwargs)
+        except Exception as e:
+            breaker.record_failure()
+            if attempt >= retries or not retryable(e):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            if expires is not None and time.monotonic() + delay >= expires:
+                raise
+            attempt += 1
+            metrics.incr("retries", stage=name)
+            print(f"⚠️ {name} failed ({e}). Retry {attempt}/{retries} in {delay:.1f}s...")
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+
+class ModelPreference:
+    """
+    Remembers, per API key, which generation models the key cannot use.
+
+    A model that fails with a non-transient error (unknown model, no access)
+    is demoted: `order(candidates)` moves it behind the others until it works
+    again or `ttl` seconds pass, when it is probed first again. Transient
+    failures never demote a model; its circuit breaker handles those. Models
+    whose circuit is open go to the back. Demotions are saved to disk so the
+    next run does not re-discover them.
+    """
+
+    def __init__(self, api_key, path=MODEL_PREFERENCE_PATH, ttl=MODEL_DEMOTION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.key_id = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        self._lock = threading.Lock()
+        entry = self._load().get(self.key_id)
+        # Files from older versions stored a single preferred model name here
+        self._demoted = dict(entry) if isinstance(entry, dict) else {}
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        data = self._load()
+        data[self.key_id] = dict(self._demoted)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        except OSError as e:
+            print(f"⚠️ Could not save the model preference: {e}")
+
+    def order(self, candidates, endpoint=lambda model: model):
+        now = time.time()
+        with self._lock:
+            demoted = {model for model, at in self._demoted.items() if now - at < self.ttl}
+        ranked = sorted(candidates, key=lambda model: model in demoted)
+        return sorted(ranked, key=lambda model: not is_available(endpoint(model)))
+
+    def record_failure(self, model, error):
+        """Demotes `model` if `error` says this key cannot use it; transient errors are ignored."""
+        if isinstance(error, CircuitOpenError) or is_transient(error):
+            return
+        with self._lock:
+            self._demoted[model] = time.time()
+            self._save()
+
+    def record_success(self, model):
+        with self._lock:
+            if self._demoted.pop(model, None) is not None:
+                self._save()
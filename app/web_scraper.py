@@ -1,13 +1,153 @@
+import threading
+from collections import namedtuple
+
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+MAX_CHARS = 2000  # Character budget for extracted text
+MAX_BYTES = 2 * 1024 * 1024  # Never download more than this per page
+CHUNK_SIZE = 16 * 1024
+
+# text: extracted paragraph text; bytes_downloaded: body bytes read off the wire;
+# bytes_used: UTF-8 size of the extracted text; content_length: advertised page size, if any;
+# etag / last_modified: validators for the next conditional request;
+# not_modified: the server answered 304 to a conditional request
+ScrapeResult = namedtuple(
+    "ScrapeResult",
+    ["text", "bytes_downloaded", "bytes_used", "content_length", "etag", "last_modified", "not_modified"],
+    defaults=(None, None, False),
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session(pool_size=32):
+    """Returns a shared requests session with a pooled connection adapter."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(HEADERS)
+            _session = session
+        return _session
+
+def extract_text(html, max_chars=MAX_CHARS):
+    """Extracts paragraph text from an HTML document."""
+    soup = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("p"))
+    return " ".join([p.text for p in soup.find_all("p")])[:max_chars]
+
+def _declared_encoding(response):
+    """Charset from the Content-Type header, if the server sent one."""
+    content_type = response.headers.get("Content-Type", "")
+    if "charset=" in content_type.lower():
+        return response.encoding
+    return None
+
+def _extract_stream_lxml(chunks, max_chars, encoding=None):
+    """Feeds chunks to an incremental lxml parser and stops once `max_chars` of <p> text is collected."""
+    parser = etree.HTMLPullParser(events=("end",), tag="p", encoding=encoding)
+    parts = []
+    length = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            text = "".join(element.itertext())
+            element.clear()  # Drop the parsed subtree as we go
+            parts.append(text)
+            length += len(text) + 1
+        if length >= max_chars:
+            return " ".join(parts)[:max_chars]
+    try:
+        parser.close()
+    except etree.LxmlError:
+        pass
+    for _, element in parser.read_events():
+        parts.append("".join(element.itertext()))
+    return " ".join(parts)[:max_chars]
+
+def _extract_stream_bs4(chunks, max_chars, encoding=None):
+    """Fallback without lxml: buffers the capped body and parses only <p> tags."""
+    body = b"".join(chunks)
+    html = body.decode(encoding or "utf-8", errors="replace")
+    return extract_text(html, max_chars)
+
+def fetch_text(url, session=None, timeout=5, max_chars=MAX_CHARS, max_bytes=MAX_BYTES, etag=None, last_modified=None):
+    """
+    Streams a page and extracts its paragraph text within a character budget.
+
+    The body is read in chunks up to `max_bytes` and parsed incrementally;
+    the download stops as soon as `max_chars` of text has been extracted.
+    Passing the `etag`/`last_modified` validators from a previous fetch makes
+    the request conditional; an unchanged page comes back with `not_modified`
+    set and no body. Raises on network errors and on 429/5xx answers.
+    """
+    with metrics.span("scrape") as span:
+        result = _fetch_text(url, session, timeout, max_chars, max_bytes, etag, last_modified)
+        span.set(outcome="not_modified" if result.not_modified else "fetched")
+    metrics.incr("bytes_scraped", result.bytes_downloaded)
+    if result.not_modified:
+        metrics.incr("pages_not_modified")
+    return result
+
+def _fetch_text(url, session, timeout, max_chars, max_bytes, etag, last_modified):
+    session = session or get_session()
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    with session.get(url, timeout=timeout, stream=True, headers=headers) as response:
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        if response.status_code == 304:
+            return ScrapeResult("", 0, 0, None, etag=validators["etag"] or etag,
+                                last_modified=validators["last_modified"] or last_modified, not_modified=True)
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()  # Transient; let the caller retry rather than store an empty page
+        encoding = _declared_encoding(response)
+        received = [0]
+
+        def capped_chunks():
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if not chunk:
+                    continue
+                remaining = max_bytes - received[0]
+                if remaining <= 0:
+                    return
+                chunk = chunk[:remaining]
+                received[0] += len(chunk)
+                yield chunk
+
+        extract = _extract_stream_lxml if etree is not None else _extract_stream_bs4
+        text = extract(capped_chunks(), max_chars, encoding)
+        content_length = response.headers.get("Content-Length")
+
+    return ScrapeResult(
+        text=text,
+        bytes_downloaded=received[0],
+        bytes_used=len(text.encode("utf-8")),
+        content_length=int(content_length) if content_length and content_length.isdigit() else None,
+        **validators,
+    )
 
 def scrape_website(url):
     """Scrapes text content from a given URL."""
     try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        response = requests.get(url, headers=headers, timeout=5)
-        soup = BeautifulSoup(response.text, "html.parser")
-        return " ".join([p.text for p in soup.find_all("p")])[:2000]  # Limit to 2000 chars
+        return fetch_text(url).text
     except Exception as e:
         print(f"Failed to scrape {url}: {e}")
         return ""
@@ -0,0 +1,265 @@
+"""
+Local stand-ins for the external services, used by the offline benchmark.
+
+One threaded HTTP server plays the Custom Search API, the Gemini
+embedding and generation endpoints and any number of review pages. Every
+service has its own latency and error rate. `FakeGenerativeModel` is a thin
+client for the fake generation endpoint, and `FakeIndex` wraps the in-memory
+vector index with the same latency/error knobs.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+EMBED_DIMENSION = 768
+WORDS = (
+    "battery lasts all day and the screen is bright sharp and easy to read outdoors "
+    "setup took minutes the build feels solid but the charger gets warm customer support "
+    "replaced mine quickly sound quality is great for the price though the case scratches "
+    "I would buy it again and recommend it to friends who want reliable value"
+).split()
+
+
+@dataclass
+class ServiceProfile:
+    """Simulated behaviour of one remote service."""
+
+    latency: float = 0.0  # Median seconds per request
+    error_rate: float = 0.0  # Share of requests answered with HTTP 503 (or an exception)
+    tail_rate: float = 0.0  # Share of requests that take `tail_factor` times longer
+    tail_factor: float = 10.0
+
+    def delay(self):
+        if self.latency <= 0:
+            return
+        seconds = self.latency * random.uniform(0.5, 1.5)
+        if self.tail_rate and random.random() < self.tail_rate:
+            seconds *= self.tail_factor
+        time.sleep(seconds)
+
+    def fails(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+def fake_embedding(text):
+    """Deterministic pseudo-random unit vector for `text`."""
+    rng = random.Random(zlib.crc32(text.encode("utf-8")))
+    values = [rng.gauss(0.0, 1.0) for _ in range(EMBED_DIMENSION)]
+    norm = sum(v * v for v in values) ** 0.5
+    return [round(v / norm, 6) for v in values]
+
+
+def fake_page(path, paragraphs):
+    """Deterministic review page HTML for `path`."""
+    rng = random.Random(zlib.crc32(path.encode("utf-8")))
+    body = "".join(
+        "<p>" + " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60))).capitalize() + ".</p>"
+        for _ in range(paragraphs)
+    )
+    return f"<html><head><title>{path}</title></head><body><nav>Home | Reviews</nav>{body}</body></html>"
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # Clients hang up on error responses without reading them; that is expected here
+
+
+class FakeServices:
+    """
+    Threaded local HTTP server for search, pages, embeddings and generation.
+
+    Routes:
+      GET  /customsearch/v1                        Custom Search results linking to /pages/...
+      GET  /pages/<slug>                           Review page HTML (with an ETag)
+      POST /v1beta/models/<model>:batchEmbedContents
+      POST /v1beta/models/<model>:generateContent
+    """
+
+    def __init__(self, search=None, pages=None, embed=None, generate=None, page_paragraphs=30):
+        self.profiles = {
+            "search": search or ServiceProfile(),
+            "pages": pages or ServiceProfile(),
+            "embed": embed or ServiceProfile(),
+            "generate": generate or ServiceProfile(),
+        }
+        self.page_paragraphs = page_paragraphs
+        self.requests = {name: 0 for name in self.profiles}
+        self._lock = threading.Lock()
+        self._server = _QuietServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-services", daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, service):
+        with self._lock:
+            self.requests[service] += 1
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json", headers=None):
+                data = body.encode("utf-8") if isinstance(body, str) else body
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _simulate(self, service):
+                services._count(service)
+                profile = services.profiles[service]
+                profile.delay()
+                if profile.fails():
+                    self._send(503, json.dumps({"error": {"code": 503, "message": f"fake {service} outage"}}))
+                    return False
+                return True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/customsearch/v1":
+                    if self._simulate("search"):
+                        self._search(parse_qs(url.query))
+                elif url.path.startswith("/pages/"):
+                    if self._simulate("pages"):
+                        self._page(url.path)
+                else:
+                    self._send(404, "{}")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                path = urlparse(self.path).path
+                if path.endswith(":batchEmbedContents"):
+                    if self._simulate("embed"):
+                        vectors = [
+                            {"values": fake_embedding(r["content"]["parts"][0]["text"])}
+                            for r in payload.get("requests", [])
+                        ]
+                        self._send(200, json.dumps({"embeddings": vectors}))
+                elif path.endswith(":generateContent"):
+                    if self._simulate("generate"):
+                        self._send(200, json.dumps(self._generate(payload.get("prompt", ""))))
+                else:
+                    self._send(404, "{}")
+
+            def _search(self, query):
+                q = query.get("q", [""])[0]
+                start = int(query.get("start", ["1"])[0])
+                num = int(query.get("num", ["10"])[0])
+                slug = re.sub(r"[^a-z0-9]+", "-", q.lower()).strip("-")
+                items = [{"link": f"{services.base_url}/pages/{slug}-{i}"} for i in range(start, start + num)]
+                self._send(200, json.dumps({"items": items}))
+
+            def _page(self, path):
+                html = fake_page(path, services.page_paragraphs)
+                etag = '"' + hashlib.md5(html.encode("utf-8")).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, b"", headers={"ETag": etag})
+                    return
+                self._send(200, html, content_type="text/html; charset=utf-8", headers={"ETag": etag})
+
+            def _generate(self, prompt):
+                match = re.search(r'product: "(.*?)"', prompt)
+                product = match.group(1) if match else "this product"
+                text = (
+                    f"Meet {product}: trusted by thousands of reviewers for all-day battery and solid build. "
+                    f"Limited stock - get yours today and see why customers love {product}!"
+                )
+                return {"text": text, "candidates_token_count": len(text.split())}
+
+        return Handler
+
+
+class _Usage:
+    def __init__(self, candidates_token_count):
+        self.candidates_token_count = candidates_token_count
+
+
+class _Response:
+    def __init__(self, text, tokens=None):
+        self.text = text
+        self.usage_metadata = _Usage(tokens) if tokens is not None else None
+
+
+class FakeGenerativeModel:
+    """Drop-in for `genai.GenerativeModel` that calls the fake generation endpoint."""
+
+    def __init__(self, base_url, name, session=None):
+        self.url = f"{base_url}/v1beta/models/{name}:generateContent"
+        self.session = session or requests.Session()
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        timeout = (request_options or {}).get("timeout", 30)
+        response = self.session.post(self.url, json={"prompt": prompt}, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        if not stream:
+            return _Response(data["text"], data.get("candidates_token_count"))
+        words = data["text"].split(" ")
+        chunks = [" ".join(words[i:i + 8]) + (" " if i + 8 < len(words) else "") for i in range(0, len(words), 8)]
+        return [_Response(chunk) for chunk in chunks[:-1]] + [_Response(chunks[-1], data.get("candidates_token_count"))]
+
+
+class FakeIndex:
+    """Wraps an in-memory index with simulated Pinecone latency and errors."""
+
+    def __init__(self, index, profile=None):
+        self.index = index
+        self.profile = profile or ServiceProfile()
+
+    def _call(self, method, *args, **kwargs):
+        self.profile.delay()
+        if self.profile.fails():
+            raise RuntimeError("fake Pinecone outage (503)")
+        return getattr(self.index, method)(*args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        return self._call("upsert", *args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        return self._call("query", *args, **kwargs)
+
+    def fetch(self, *args, **kwargs):
+        return self._call("fetch", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call("delete", *args, **kwargs)
+
+    def describe_index_stats(self, **kwargs):
+        return self.index.describe_index_stats(**kwargs)
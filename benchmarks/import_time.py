@@ -0,0 +1,76 @@
+"""
+Import-time regression guard for the app modules.
+
+Imports each module in a fresh interpreter, reports the median wall time and
+fails (exit code 1) if a module exceeds its budget or pulls in one of the heavy
+dependencies that must only load on first use.
+
+    python benchmarks/import_time.py [--runs 5] [--budget 0.75]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+MODULES = ["main", "pipeline", "pinecone_db", "ad_generator", "embedding"]
+
+# These take seconds to import (or open network clients) and must stay lazy
+HEAVY_MODULES = ["sentence_transformers", "torch", "google.generativeai", "pinecone", "numpy"]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print("elapsed=" + repr(elapsed))
+print("heavy=" + ",".join(heavy))
+"""
+
+
+def measure(module, runs):
+    timings = []
+    heavy = set()
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=APP_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+        fields = dict(line.split("=", 1) for line in result.stdout.splitlines() if "=" in line)
+        timings.append(float(fields["elapsed"]))
+        heavy.update(name for name in fields["heavy"].split(",") if name)
+    return statistics.median(timings), sorted(heavy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("--budget", type=float, default=0.75, help="Maximum median import time in seconds")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    failed = False
+    started = time.perf_counter()
+    for module in args.modules:
+        median, heavy = measure(module, args.runs)
+        status = "ok"
+        if median > args.budget:
+            status, failed = f"SLOW (budget {args.budget:.2f}s)", True
+        if heavy:
+            status, failed = f"EAGER IMPORT: {', '.join(heavy)}", True
+        print(f"{module:<14} {median * 1000:8.1f} ms  {status}")
+    print(f"({time.perf_counter() - started:.1f}s total)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
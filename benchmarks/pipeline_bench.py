@@ -0,0 +1,258 @@
+"""
+Offline end-to-end benchmark: google_search -> scrape -> store -> generate_ad.
+
+Every external service is replaced by the local fakes in `fakes.py` (search,
+review pages, Gemini embeddings and generation over a local HTTP server, and
+an in-memory Pinecone index), each with configurable latency and error
+rates. Reports p50/p95/p99 latency per product and per stage plus items per
+second, and saves the results as JSON so runs can be compared.
+
+    python benchmarks/pipeline_bench.py --products 50 --concurrency 8
+    python benchmarks/pipeline_bench.py --mode pipeline --page-latency 0.2 --compare benchmarks/results/<previous>.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fakes import FakeGenerativeModel, FakeIndex, FakeServices, ServiceProfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT_DIR, "app")
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (None for no values)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def latency_summary(values):
+    summary = {"count": len(values)}
+    for pct in PERCENTILES:
+        summary[f"p{pct}"] = percentile(values, pct)
+    summary["mean"] = sum(values) / len(values) if values else None
+    summary["max"] = max(values) if values else None
+    return summary
+
+
+def configure_environment(base_url, cache_dir, respect_rate_limits):
+    """Points the app at the fakes; must run before any app module is imported."""
+    os.environ.update({
+        "GEMINI_API_KEY": "offline-benchmark",
+        "GOOGLE_SEARCH_API": "offline-benchmark",
+        "GOOGLE_CSE_ID": "offline-benchmark",
+        "GEMINI_API_BASE": base_url,
+        "GOOGLE_SEARCH_URL": f"{base_url}/customsearch/v1",
+        "VECTOR_BACKEND": "memory",
+        "MARKPAL_CACHE_DIR": cache_dir,
+        "MARKPAL_METRICS": "true",
+        "NO_PROXY": "127.0.0.1,localhost",
+    })
+    if not respect_rate_limits:
+        # A rate of zero disables the token buckets so the fakes' latency is what gets measured
+        os.environ.update({
+            "EMBED_REQUESTS_PER_MINUTE": "0",
+            "GEMINI_FLASH_RPM": "0",
+            "TEXT_BISON_RPM": "0",
+            "SEARCH_REQUESTS_PER_MINUTE": "0",
+        })
+    sys.path.insert(0, APP_DIR)
+
+
+def install_fakes(base_url, index_profile):
+    import ad_generator
+    import pinecone_db
+
+    for name in (ad_generator.PRIMARY_MODEL, ad_generator.FALLBACK_MODEL):
+        ad_generator.register_model(name, FakeGenerativeModel(base_url, name))
+    pinecone_db.open_index = lambda name, backend=None: FakeIndex(pinecone_db.InMemoryIndex(), index_profile)
+
+
+def run_product_simple(product, urls_per_product):
+    """The step-by-step path: each page is scraped and stored on its own."""
+    from ad_generator import generate_ad
+    from google_search import google_search
+    from pinecone_db import store_in_pinecone
+    from web_scraper import scrape_website
+
+    urls = google_search(product + " reviews", num_results=urls_per_product)
+    pages = 0
+    for url in urls:
+        text = scrape_website(url)
+        if text:
+            store_in_pinecone(text, {"url": url, "product": product, "content": text})
+            pages += 1
+    generate_ad(product, force_regenerate=True)
+    return pages
+
+
+def run_product_pipeline(product, urls_per_product):
+    """The path `main()` takes: concurrent scrape/chunk/embed/store pipeline."""
+    from ad_generator import generate_ad
+    from google_search import google_search
+    from pipeline import run_scrape_pipeline
+
+    urls = google_search(product + " reviews", num_results=urls_per_product)
+    run = run_scrape_pipeline(urls, product)
+    generate_ad(product, force_regenerate=True)
+    return len(run.contents)
+
+
+def stage_summaries(spans):
+    """Latency summary per stage, split by the labels that tell backends/models apart."""
+    grouped = {}
+    for record in spans:
+        label = record.get("backend") or record.get("model") or record.get("mode") or record.get("method")
+        name = f"{record['stage']}[{label}]" if label else record["stage"]
+        grouped.setdefault(name, []).append(record["duration"])
+    return {name: latency_summary(durations) for name, durations in sorted(grouped.items())}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    profiles = {
+        name: ServiceProfile(getattr(args, f"{name}_latency"), getattr(args, f"{name}_errors"), args.tail_rate)
+        for name in ("search", "page", "embed", "generate", "index")
+    }
+    services = FakeServices(
+        search=profiles["search"],
+        pages=profiles["page"],
+        embed=profiles["embed"],
+        generate=profiles["generate"],
+        page_paragraphs=args.page_paragraphs,
+    ).start()
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="markpal-bench-")
+    configure_environment(services.base_url, cache_dir, args.respect_rate_limits)
+    install_fakes(services.base_url, profiles["index"])
+
+    import metrics
+
+    run_product = run_product_pipeline if args.mode == "pipeline" else run_product_simple
+    products = [f"Bench Product {i:05d}" for i in range(args.products)]
+    latencies, pages, errors = [], [0], [0]
+    lock = threading.Lock()
+
+    def timed(product):
+        started = time.perf_counter()
+        stored, failed = 0, 0
+        try:
+            stored = run_product(product, args.urls_per_product)
+        except Exception:
+            failed = 1
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            pages[0] += stored
+            errors[0] += failed
+
+    print(f"⏱️ {args.products} products x {args.urls_per_product} pages, {args.concurrency} concurrent, mode={args.mode}")
+    started = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(timed, products))
+    elapsed = time.perf_counter() - started
+    services.stop()
+
+    counters = {}
+    for counter in metrics.snapshot()["counters"]:
+        labels = ",".join(f"{k}={v}" for k, v in sorted(counter["labels"].items()))
+        counters[f"{counter['name']}{{{labels}}}" if labels else counter["name"]] = counter["value"]
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "verbose")},
+        "elapsed_seconds": elapsed,
+        "products_per_second": args.products / elapsed,
+        "pages_per_second": pages[0] / elapsed,
+        "pages_stored": pages[0],
+        "failed_products": errors[0],
+        "product_latency": latency_summary(latencies),
+        "stages": stage_summaries(metrics.spans()),
+        "service_requests": services.requests,
+        "counters": counters,
+    }
+
+
+def _ms(value):
+    return f"{value * 1000:9.1f}" if value is not None else "        -"
+
+
+def print_report(result, baseline=None):
+    print(f"\n✅ {result['products_per_second']:.2f} products/s, {result['pages_per_second']:.2f} pages/s "
+          f"({result['elapsed_seconds']:.2f}s, {result['failed_products']} failed)")
+    print(f"\n{'':28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = [("product", result["product_latency"])] + list(result["stages"].items())
+    for name, summary in rows:
+        print(f"{name:28}{summary['count']:>7}{_ms(summary['p50'])} {_ms(summary['p95'])} {_ms(summary['p99'])}")
+
+    if baseline:
+        print(f"\n📊 Compared with {baseline.get('timestamp')} ({baseline.get('git_revision')}):")
+        before, after = baseline["products_per_second"], result["products_per_second"]
+        print(f"   products/s   {before:8.2f} -> {after:8.2f} ({(after / before - 1) * 100:+.1f}%)")
+        for pct in PERCENTILES:
+            key = f"p{pct}"
+            before, after = baseline["product_latency"][key], result["product_latency"][key]
+            if before and after:
+                print(f"   product {key:4} {before * 1000:8.1f} -> {after * 1000:8.1f} ms ({(after / before - 1) * 100:+.1f}%)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--urls-per-product", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4, help="Products processed at once")
+    parser.add_argument("--mode", choices=("simple", "pipeline"), default="simple",
+                        help="simple: scrape_website + store_in_pinecone per page; pipeline: run_scrape_pipeline")
+    parser.add_argument("--page-paragraphs", type=int, default=30)
+    for name, latency in (("search", 0.05), ("page", 0.1), ("embed", 0.05), ("generate", 0.5), ("index", 0.02)):
+        parser.add_argument(f"--{name}-latency", type=float, default=latency, help=f"Median {name} latency in seconds")
+        parser.add_argument(f"--{name}-errors", type=float, default=0.0, help=f"Share of {name} requests that fail")
+    parser.add_argument("--tail-rate", type=float, default=0.01, help="Share of requests that are 10x slower")
+    parser.add_argument("--respect-rate-limits", action="store_true", help="Keep the app's API rate limiters on")
+    parser.add_argument("--cache-dir", help="Cache directory (a fresh temporary one by default)")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", metavar="RESULTS_JSON", help="Earlier results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's own progress output")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    result = run_benchmark(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\n💾 Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()